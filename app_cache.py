@@ -0,0 +1,47 @@
+import pandas as pd
+import streamlit as st
+
+from dataset_cache import file_fingerprint
+from result_cache import RESULT_CACHE_MAX_BYTES, ResultCache
+
+
+# One size-bounded cache per Streamlit server process, shared by all sessions
+@st.cache_resource
+def result_cache():
+    return ResultCache(RESULT_CACHE_MAX_BYTES)
+
+
+# Content hash of an upload, computed once per uploaded file rather than on
+# every rerun
+def upload_fingerprint(file):
+    fingerprints = st.session_state.setdefault('upload_fingerprints', {})
+    upload_key = getattr(file, 'file_id', None) or (file.name, file.size)
+    if upload_key not in fingerprints:
+        fingerprints[upload_key] = file_fingerprint(file)
+    return fingerprints[upload_key]
+
+
+# Copy of a cached value for one caller: frames are copied (also inside
+# tuples and lists), so a session editing its result cannot change what other
+# sessions and reruns get. Other objects, such as the hourly cube, are shared
+# and only read by the apps.
+def _copy(value):
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return value.copy()
+    if isinstance(value, (tuple, list)):
+        return type(value)(_copy(item) for item in value)
+    return value
+
+
+# Memoize a pipeline stage by name and the parameters that affect its output
+def cached(stage, key, compute):
+    return _copy(result_cache().get_or_compute((stage,) + tuple(key), compute))
+
+
+def show_cache_stats():
+    stats = result_cache().stats()
+    with st.sidebar.expander("Result cache"):
+        st.write(f"{stats['entries']} entries, {stats['bytes'] / 2**20:,.0f} of {stats['max_bytes'] / 2**20:,.0f} MiB")
+        st.write(f"Hits {stats['hits']}, misses {stats['misses']} (hit rate {stats['hit_rate']:.0%}), evictions {stats['evictions']}")
+        if st.button("Clear result cache"):
+            result_cache().clear()
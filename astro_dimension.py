@@ -0,0 +1,96 @@
+import hashlib
+import io
+import os
+import tempfile
+import urllib.request
+
+import pandas as pd
+
+ASTRO_TYPE_PATH = os.environ.get('NSM_ASTRO_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'astro_type.csv'))
+ASTRO_TYPE_SOURCE = os.environ.get('NSM_ASTRO_SOURCE', 'https://github.com/Jay5973/North-Star-Metrix/blob/main/astro_type.csv?raw=true')
+
+# Compact dtypes for the dimension's columns. Int32 is nullable, so blank cells
+# load as <NA>; a column holding fractions or values beyond int32 stays float.
+ASTRO_DTYPES = {
+    'experience': 'Int32', 'chatRate': 'Int32', 'callRate': 'Int32', 'servedCount': 'Int32',
+    'averageRating': 'float64', 'totalEarnings': 'float64', 'freeChatRate': 'Int32', 'commissionPercentage': 'Int32',
+    'badge': 'category', 'status': 'category', 'isOnline': 'bool', 'isBusy': 'bool',
+}
+ASTRO_DATES = ['createdAt', 'updatedAt']
+
+# path -> (mtime_ns, size, content digest, frame)
+_loaded = {}
+
+
+def _digest(data):
+    return hashlib.blake2b(data, digest_size=20).hexdigest()
+
+
+def _to_int32(values):
+    values = pd.to_numeric(values, errors='coerce')
+    present = values.dropna()
+    if present.empty or (present.mod(1).eq(0).all() and present.abs().max() < 2**31):
+        return values.astype('Int32')
+    return values
+
+
+def _parse(data):
+    frame = pd.read_csv(io.BytesIO(data), dtype={column: dtype for column, dtype in ASTRO_DTYPES.items() if dtype == 'category'})
+    if '_id' not in frame.columns:
+        raise ValueError("astro_type.csv has no _id column")
+    for column, dtype in ASTRO_DTYPES.items():
+        if column not in frame.columns:
+            continue
+        if dtype == 'bool':
+            frame[column] = frame[column].astype(str).str.lower().eq('true')
+        elif dtype == 'Int32':
+            frame[column] = _to_int32(frame[column])
+        elif dtype == 'float64':
+            frame[column] = pd.to_numeric(frame[column], errors='coerce')
+    for column in ASTRO_DATES:
+        if column in frame.columns:
+            frame[column] = pd.to_datetime(frame[column], errors='coerce')
+    return frame.drop_duplicates('_id').set_index('_id')
+
+
+# Replace the local copy with the source's bytes (atomically); returns True when
+# the content changed
+def refresh_astro_dimension(path=ASTRO_TYPE_PATH, source=ASTRO_TYPE_SOURCE, timeout=30):
+    with urllib.request.urlopen(source, timeout=timeout) as response:
+        data = response.read()
+    _parse(data)  # refuse to install a file that does not parse
+    if os.path.exists(path):
+        with open(path, 'rb') as handle:
+            if _digest(handle.read()) == _digest(data):
+                return False
+    handle, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', suffix='.tmp')
+    with os.fdopen(handle, 'wb') as out:
+        out.write(data)
+    os.replace(tmp_path, path)
+    return True
+
+
+# Astrologer dimension (name, type, rates, ...) indexed by _id, read from the
+# bundled astro_type.csv. The parsed frame is memoized per process and only
+# re-read when the file's mtime/size changes and its content hash differs.
+# refresh=True first pulls the file from `source`. Treat the result as read-only.
+def load_astro_dimension(path=ASTRO_TYPE_PATH, refresh=False, source=ASTRO_TYPE_SOURCE):
+    if refresh:
+        refresh_astro_dimension(path, source)
+    stat = os.stat(path)
+    cached = _loaded.get(path)
+    if cached and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+        return cached[3]
+
+    with open(path, 'rb') as handle:
+        data = handle.read()
+    digest = _digest(data)
+    frame = cached[3] if cached and cached[2] == digest else _parse(data)
+    _loaded[path] = (stat.st_mtime_ns, stat.st_size, digest, frame)
+    return frame
+
+
+# Content hash of the currently loaded dimension, e.g. to key derived caches
+def astro_dimension_version(path=ASTRO_TYPE_PATH):
+    load_astro_dimension(path)
+    return _loaded[path][2]
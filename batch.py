@@ -0,0 +1,177 @@
+import argparse
+import os
+import sys
+from datetime import datetime
+
+import pandas as pd
+
+from astro_dimension import ASTRO_TYPE_PATH, load_astro_dimension
+from cube import HourlyCube
+from dataset_cache import path_fingerprint
+from duckdb_backend import DuckDBProcessor
+from events import extract_json
+from ids import encode_ids
+from ingest import filter_chats, read_chat_csv, read_profile_csv
+from instrumentation import StageRecorder
+from north_star import iterate_date_range
+from north_star_state import DEFAULT_STATE_PATH, NorthStarState
+from polars_backend import PolarsProcessor
+from processor import CompletedExportProcessor, UniqueUsersProcessor
+from streaming import read_events_streaming
+
+# Headless entry point for the dashboards' computations, e.g. for cron backfills:
+#   python batch.py north-star chat.csv profile.csv --start 15-08-24 --end 22-10-24 -o north_star.parquet
+#   python batch.py hourly raw_data.csv -o out/ --format parquet
+# No Streamlit or plotly import; outputs are Parquet or CSV.
+
+FORMATS = ('parquet', 'csv')
+
+
+def log(message):
+    print(f"[{datetime.now():%H:%M:%S}] {message}", file=sys.stderr)
+
+
+def output_format(path, default='csv'):
+    extension = os.path.splitext(path)[1].lstrip('.').lower()
+    return extension if extension in FORMATS else default
+
+
+def write_table(frame, path, file_format=None):
+    file_format = file_format or output_format(path)
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    if file_format == 'parquet':
+        frame.to_parquet(path, index=False)
+    else:
+        frame.to_csv(path, index=False)
+    log(f"wrote {len(frame):,} rows to {path}")
+
+
+def run_north_star(args, recorder):
+    with recorder.stage('load') as stage:
+        filtered_chat_df, profile_df = encode_ids(recorder.call('filter_chats', filter_chats, recorder.call('read_chats', read_chat_csv, args.chats)),
+                                                  recorder.call('read_profiles', read_profile_csv, args.profiles))
+        stage.rows_out = len(filtered_chat_df)
+    log(f"loaded {len(filtered_chat_df):,} chats and {len(profile_df):,} profiles in {stage.seconds:.1f} s")
+
+    with recorder.stage('north_star', len(filtered_chat_df)) as stage:
+        if args.incremental:
+            state = NorthStarState.load(args.state)
+            state.update(filtered_chat_df, profile_df, datetime.strptime(args.end, '%d-%m-%y'), start_date=datetime.strptime(args.start, '%d-%m-%y'))
+            state.save(args.state)
+            result_df = state.history
+        else:
+            result_df = iterate_date_range(filtered_chat_df, profile_df, args.start, args.end, mode=args.mode, workers=args.workers)
+        stage.rows_out = len(result_df)
+    log(f"computed {len(result_df):,} days in {stage.seconds:.1f} s")
+    recorder.call('write', write_table, result_df, args.output)
+
+
+def run_hourly(args, recorder):
+    if args.backend != 'pandas':
+        if args.completed:
+            raise SystemExit("--completed is only supported by the pandas backend")
+        return run_hourly_scan(args, recorder)
+    with recorder.stage('load') as stage:
+        if args.streaming:
+            raw_df = recorder.call('read_events_streaming', read_events_streaming, args.events, chunksize=args.chunksize)
+        else:
+            raw_df = recorder.call('extract_json', extract_json, recorder.call('read_events', pd.read_csv, args.events), 'other_data')
+        astro_df = load_astro_dimension(args.astro)
+        # Identified by path, size and mtime: hashing every event column only
+        # to key the memo would cost about half as much as the tables
+        fingerprint = path_fingerprint(args.events) + (path_fingerprint(args.completed) if args.completed else '')
+        options = dict(cancellation_match=args.cancellation_match, distinct=args.distinct, fingerprint=fingerprint)
+        if args.completed:
+            completed_df = recorder.call('read_completed', pd.read_csv, args.completed)
+            raw_df, completed_df = recorder.call('encode_ids', encode_ids, raw_df, completed_df)
+            processor = CompletedExportProcessor(raw_df, completed_df, astro_df, **options)
+        else:
+            processor = UniqueUsersProcessor(recorder.call('encode_ids', encode_ids, raw_df), astro_df, **options)
+        stage.rows_out = len(raw_df)
+    log(f"loaded {len(raw_df):,} events in {stage.seconds:.1f} s")
+
+    with recorder.stage('hourly_tables', len(raw_df)) as stage:
+        astrologer_hourly = recorder.call('merge_with_astro_data', processor.merge_with_astro_data, recorder.call('astrologer_hourly', processor.astrologer_hourly))
+        overall_hourly = recorder.call('overall_hourly', processor.overall_hourly)
+    log(f"computed hourly tables in {stage.seconds:.1f} s")
+
+    write_hourly(args, recorder, processor, astro_df, astrologer_hourly, overall_hourly)
+
+
+# DuckDB and Polars scan the export themselves (CSV or Parquet), so nothing is
+# loaded into pandas before the hourly tables
+def run_hourly_scan(args, recorder):
+    astro_df = load_astro_dimension(args.astro)
+    options = dict(cancellation_match=args.cancellation_match, distinct=args.distinct)
+    if args.backend == 'duckdb':
+        processor = DuckDBProcessor(args.events, astro_df, threads=args.threads, memory_limit=args.memory_limit, temp_directory=args.temp_directory, **options)
+        load = lambda: processor.connection
+    else:
+        processor = PolarsProcessor(args.events, astro_df, **options)
+        load = lambda: processor.metric_frames
+    with recorder.stage('hourly_tables') as stage:
+        recorder.call('load', load)
+        astrologer_hourly = recorder.call('merge_with_astro_data', processor.merge_with_astro_data, recorder.call('astrologer_hourly', processor.astrologer_hourly))
+        overall_hourly = recorder.call('overall_hourly', processor.overall_hourly)
+    log(f"computed hourly tables with {args.backend} in {stage.seconds:.1f} s")
+    write_hourly(args, recorder, processor, astro_df, astrologer_hourly, overall_hourly)
+
+
+def write_hourly(args, recorder, processor, astro_df, astrologer_hourly, overall_hourly):
+    with recorder.stage('write'):
+        write_table(astrologer_hourly, os.path.join(args.output, f'astrologer_hourly.{args.format}'), args.format)
+        write_table(overall_hourly, os.path.join(args.output, f'overall_hourly.{args.format}'), args.format)
+    if args.cube:
+        with recorder.stage('hourly_cube'):
+            HourlyCube.build(processor, astro_df).save(args.cube)
+        log(f"saved hourly cube to {args.cube}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the North Star and hourly metric pipelines without the Streamlit UI")
+    parser.add_argument('--metrics-json', help="append per-stage timings and peak memory to this JSON-lines file")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    north_star = commands.add_parser('north-star', help="users completing their 4th chat per day (north-star-metrix.py)")
+    north_star.add_argument('chats', help="chat export CSV")
+    north_star.add_argument('profiles', help="user profile export CSV")
+    north_star.add_argument('--start', required=True, help="first day, DD-MM-YY")
+    north_star.add_argument('--end', required=True, help="last day, DD-MM-YY")
+    north_star.add_argument('--mode', choices=['cumulative', 'reference', 'polars'], default='cumulative')
+    north_star.add_argument('--workers', type=int, default=1, help="processes for --mode cumulative")
+    north_star.add_argument('--incremental', action='store_true', help="only compute days after the saved state")
+    north_star.add_argument('--state', default=DEFAULT_STATE_PATH)
+    north_star.add_argument('-o', '--output', required=True, help="output file; .parquet or .csv")
+    north_star.set_defaults(run=run_north_star)
+
+    hourly = commands.add_parser('hourly', help="per-astrologer and overall hourly metrics (test5.py)")
+    hourly.add_argument('events', help="raw_data.csv event export (or .parquet with --backend duckdb or polars)")
+    hourly.add_argument('--completed', help="chat_completed_data.csv; counts completed chats from it as script.py does")
+    hourly.add_argument('--astro', default=ASTRO_TYPE_PATH, help="astro_type.csv")
+    hourly.add_argument('--streaming', action='store_true', help="read the events in chunks")
+    hourly.add_argument('--chunksize', type=int, default=500_000)
+    hourly.add_argument('--cancellation-match', choices=['latest', 'cartesian'], default='latest')
+    hourly.add_argument('--distinct', choices=['exact', 'hll'], default='exact')
+    hourly.add_argument('--cube', help="also save the hourly cube to this path")
+    hourly.add_argument('--backend', choices=['pandas', 'duckdb', 'polars'], default='pandas',
+                        help="duckdb: multithreaded SQL over the export, spilling to disk past --memory-limit; polars: one lazy query plan over a scan of the export")
+    hourly.add_argument('--threads', type=int, help="DuckDB worker threads (default: all cores)")
+    hourly.add_argument('--memory-limit', help="DuckDB memory limit, e.g. 4GB")
+    hourly.add_argument('--temp-directory', help="where DuckDB spills when over the memory limit")
+    hourly.add_argument('-o', '--output', required=True, help="output directory")
+    hourly.add_argument('--format', choices=FORMATS, default='parquet')
+    hourly.set_defaults(run=run_hourly)
+
+    args = parser.parse_args(argv)
+    if args.command == 'north-star' and args.workers > 1 and args.mode != 'cumulative':
+        parser.error("--workers needs --mode cumulative")
+    # Memory tracing slows allocation-heavy stages, so it is only on when the
+    # timings are kept
+    recorder = StageRecorder(trace_memory=bool(args.metrics_json))
+    args.run(args, recorder)
+    if args.metrics_json:
+        recorder.export(args.metrics_json, command=args.command)
+
+
+if __name__ == '__main__':
+    main()
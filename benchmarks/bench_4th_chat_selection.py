@@ -0,0 +1,64 @@
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from north_star import select_completing_users
+
+
+# The selection as it used to be written, kept here only for comparison
+def legacy_select_completing_users(user_chat_counts_up_to_yesterday, user_chat_counts_today, recent_user_ids):
+    users_less_than_4_chats_yesterday = user_chat_counts_up_to_yesterday[user_chat_counts_up_to_yesterday < 4].index
+    users_completing_4th_chat_today = [
+        user_id for user_id in users_less_than_4_chats_yesterday
+        if user_chat_counts_up_to_yesterday.get(user_id, 0) + user_chat_counts_today.get(user_id, 0) == 4
+    ]
+    return [user_id for user_id in users_completing_4th_chat_today if user_id in recent_user_ids]
+
+
+def make_counts(n_users, seed):
+    rng = np.random.default_rng(seed)
+    user_ids = np.array([f"{value:024x}" for value in rng.integers(0, 2**63, n_users)], dtype=object)
+    user_ids = np.unique(user_ids)
+    counts_before = pd.Series(rng.integers(1, 8, len(user_ids)), index=user_ids).sort_index()
+    today_users = rng.choice(user_ids, len(user_ids) // 3, replace=False)
+    counts_today = pd.Series(rng.integers(1, 4, len(today_users)), index=today_users).sort_index()
+    recent_user_ids = pd.Series(rng.choice(user_ids, len(user_ids) // 2, replace=False)).unique()
+    return counts_before, counts_today, recent_user_ids
+
+
+def best_of(func, args, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func(*args)
+        timings.append(time.perf_counter() - started)
+    return min(timings), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmark for the 4th-chat user selection")
+    parser.add_argument('--users', type=int, default=500_000, help="candidate users for the vectorized path")
+    parser.add_argument('--legacy-users', type=int, default=20_000, help="candidate users for the list-comprehension path (quadratic)")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    # Same-size comparison, also checks both paths agree
+    small = make_counts(args.legacy_users, args.seed)
+    legacy_time, legacy_result = best_of(legacy_select_completing_users, small, 1)
+    vector_time, vector_result = best_of(select_completing_users, small, args.repeat)
+    assert legacy_result == vector_result, "vectorized selection disagrees with the legacy path"
+    print(f"{args.legacy_users:>9,} users  legacy {legacy_time * 1000:10.1f} ms  vectorized {vector_time * 1000:8.1f} ms  speedup {legacy_time / vector_time:8.0f}x")
+
+    large = make_counts(args.users, args.seed)
+    vector_time, vector_result = best_of(select_completing_users, large, args.repeat)
+    print(f"{args.users:>9,} users  vectorized {vector_time * 1000:8.1f} ms  ({len(vector_result):,} selected)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from events import extract_json
+
+
+# extract_json as the Streamlit apps used to define it
+def legacy_extract_json(raw_df, json_column):
+    json_data = []
+    for item in raw_df[json_column]:
+        try:
+            data = json.loads(item)
+            json_data.append(data)
+        except (json.JSONDecodeError, TypeError):
+            continue
+    json_df = pd.json_normalize(json_data)
+    combined_df = pd.concat([raw_df, json_df], axis=1)
+    return combined_df
+
+
+def make_raw_df(rows, seed):
+    rng = np.random.default_rng(seed)
+    ids = np.array([f"{value:024x}" for value in rng.integers(0, 2**63, 5000)], dtype=object)
+    astrologers, clients, sessions = rng.choice(ids[:200], rows), rng.choice(ids, rows), rng.choice(ids, rows)
+    paid = rng.integers(0, 2, rows)
+    other_data = [
+        json.dumps({'astrologerId': a, 'clientId': c, 'paid': int(p), 'chatSessionId': s, 'platform': 'android', 'appVersion': '3.2.1'})
+        for a, c, p, s in zip(astrologers, clients, paid, sessions)
+    ]
+    return pd.DataFrame({
+        'event_name': rng.choice(['chat_intake_submit', 'accept_chat', 'chat_msg_send', 'open_page'], rows),
+        'user_id': rng.choice(ids, rows),
+        'other_data': other_data,
+    })
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the legacy and typed extract_json")
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    raw_df = make_raw_df(args.rows, args.seed)
+    for label, func in [('legacy json_normalize', legacy_extract_json), ('events.extract_json', extract_json)]:
+        started = time.perf_counter()
+        func(raw_df, 'other_data')
+        print(f"{label:<22} {args.rows:>11,} rows  {time.perf_counter() - started:7.2f} s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+import argparse
+import os
+import sys
+import time
+
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from events import extract_json
+from ids import IdRegistry, ID_COLUMNS
+from processor import UniqueUsersProcessor
+from synthetic import make_raw_events
+
+
+def id_bytes(frame):
+    usage = frame.memory_usage(deep=True, index=False)
+    return sum(usage[column] for column in frame.columns if column in ID_COLUMNS)
+
+
+def time_tables(raw_df, astro_df):
+    started = time.perf_counter()
+    processor = UniqueUsersProcessor(raw_df, astro_df, cancellation_match='latest')
+    processor.merge_with_astro_data(processor.astrologer_hourly())
+    processor.overall_hourly()
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Memory and processing time of string vs dictionary-encoded id columns")
+    parser.add_argument('path', nargs='?', help="raw_data.csv export to load; synthetic events are generated if omitted")
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    raw_df = pd.read_csv(args.path) if args.path else make_raw_events(args.rows, args.seed)
+    raw_df = extract_json(raw_df, 'other_data')
+    astro_df = pd.DataFrame({'_id': pd.Series(dtype=object), 'name': pd.Series(dtype=object), 'type': pd.Series(dtype=object)})
+
+    started = time.perf_counter()
+    encoded = IdRegistry().encode(raw_df)
+    encode_time = time.perf_counter() - started
+
+    before, after = id_bytes(raw_df), id_bytes(encoded)
+    print(f"{len(raw_df):,} events, id columns: {[column for column in raw_df.columns if column in ID_COLUMNS]}")
+    print(f"id columns   strings {before / 2**20:8.0f} MiB  encoded {after / 2**20:8.0f} MiB  ({before / max(after, 1):.1f}x smaller, encode {encode_time:.2f} s)")
+    print(f"whole frame  strings {raw_df.memory_usage(deep=True).sum() / 2**20:8.0f} MiB  encoded {encoded.memory_usage(deep=True).sum() / 2**20:8.0f} MiB")
+    print(f"hourly tables  strings {time_tables(raw_df, astro_df):6.2f} s  encoded {time_tables(encoded, astro_df):6.2f} s")
+
+
+if __name__ == '__main__':
+    main()
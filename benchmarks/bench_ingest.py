@@ -0,0 +1,67 @@
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from ingest import HAS_PYARROW, read_chat_csv
+
+
+# The load as north-star-metrix.py used to do it
+def legacy_read_chat_csv(path):
+    chat_df = pd.read_csv(path)
+    chat_df['createdAt'] = pd.to_datetime(chat_df['createdAt']).dt.tz_localize(None)
+    return chat_df
+
+
+def write_chat_csv(path, rows, seed):
+    rng = np.random.default_rng(seed)
+    users = np.array([f"{value:024x}" for value in rng.integers(0, 2**63, max(rows // 20, 1))], dtype=object)
+    created = pd.Timestamp('2024-06-01', tz='UTC') + pd.to_timedelta(rng.integers(0, 150 * 86_400_000, rows), unit='ms')
+    pd.DataFrame({
+        '_id': [f"{value:024x}" for value in rng.integers(0, 2**63, rows)],
+        'userId': rng.choice(users, rows),
+        'astrologerId': rng.choice(users[:200], rows),
+        'createdAt': created.strftime('%Y-%m-%dT%H:%M:%S.%f').str[:-3] + 'Z',
+        'hasFreeMins': rng.integers(0, 2, rows),
+        'endReason': rng.choice(['NOT_STARTED', 'USER_ENDED', 'ASTROLOGER_ENDED', 'TIMEOUT'], rows),
+        'status': rng.choice(['COMPLETED', 'CANCELLED'], rows),
+        'duration': rng.integers(0, 3600, rows),
+    }).to_csv(path, index=False)
+
+
+def measure(loader, path):
+    tracemalloc.start()
+    started = time.perf_counter()
+    frame = loader(path)
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak, frame.memory_usage(deep=True).sum()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the legacy and typed chat CSV loaders")
+    parser.add_argument('path', nargs='?', help="chat export to load; a synthetic one is written if omitted")
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    path = args.path
+    if path is None:
+        path = os.path.join(tempfile.mkdtemp(), 'chat_data.csv')
+        write_chat_csv(path, args.rows, args.seed)
+    print(f"{path}: {os.path.getsize(path) / 2**20:,.0f} MiB, pyarrow engine: {'yes' if HAS_PYARROW else 'no'}")
+
+    for label, loader in [('legacy pd.read_csv', legacy_read_chat_csv), ('ingest.read_chat_csv', read_chat_csv)]:
+        elapsed, peak, resident = measure(loader, path)
+        print(f"{label:<22} load {elapsed:7.2f} s  peak alloc {peak / 2**20:8.0f} MiB  frame {resident / 2**20:8.0f} MiB")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+import argparse
+import importlib.util
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import warnings
+
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from events import extract_json
+from synthetic import make_raw_events
+
+METRICS = [
+    'process_chat_intake_requests', 'process_chat_accepted_events', 'process_chat_completed_events',
+    'process_paid_chat_completed_events', 'process_chat_cancels', 'cancellation_time',
+    'process_overall_chat_completed_events', 'process_overall_chat_intake_requests',
+    'process_overall_chat_accepted_events', 'astros_live', 'users_live',
+]
+
+
+# Load processor.py as it was at a git revision, to time it against the working tree
+def load_processor(revision=None):
+    path = os.path.join(ROOT, 'processor.py')
+    if revision:
+        source = subprocess.run(['git', 'show', f'{revision}:processor.py'], cwd=ROOT, check=True, capture_output=True, text=True).stdout
+        path = os.path.join(tempfile.mkdtemp(), 'processor.py')
+        with open(path, 'w') as handle:
+            handle.write(source)
+    spec = importlib.util.spec_from_file_location(f'processor_{revision or "worktree"}', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def time_processor(module, raw_df):
+    timings = {}
+    started = time.perf_counter()
+    # Empty astrologer dimension: the timed metrics do not read it
+    processor = module.UniqueUsersProcessor(raw_df, pd.DataFrame(columns=['_id', 'name', 'type']))
+    timings['__init__'] = time.perf_counter() - started
+    for name in METRICS:
+        started = time.perf_counter()
+        getattr(processor, name)()
+        timings[name] = time.perf_counter() - started
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time every UniqueUsersProcessor metric, optionally against an older revision")
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--ref', help="git revision to compare against, e.g. HEAD~1")
+    args = parser.parse_args()
+    warnings.simplefilter('ignore')
+
+    raw_df = extract_json(make_raw_events(args.rows, args.seed), 'other_data')
+    runs = [('worktree', load_processor())]
+    if args.ref:
+        runs.insert(0, (args.ref, load_processor(args.ref)))
+    results = {label: time_processor(module, raw_df) for label, module in runs}
+
+    print(f"{args.rows:,} rows" + ''.join(f"  {label:>10}" for label, _ in runs))
+    for name in ['__init__'] + METRICS:
+        print(f"{name:<40}" + ''.join(f"  {results[label][name]:9.3f}s" for label, _ in runs))
+    print(f"{'total':<40}" + ''.join(f"  {sum(results[label].values()):9.3f}s" for label, _ in runs))
+
+
+if __name__ == '__main__':
+    main()
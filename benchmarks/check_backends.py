@@ -0,0 +1,149 @@
+import argparse
+import os
+import sys
+import tempfile
+import time
+import warnings
+
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from astro_dimension import load_astro_dimension
+from cube import HourlyCube
+from duckdb_backend import HAS_DUCKDB, DuckDBProcessor
+from events import extract_json
+from ids import encode_ids
+from ingest import filter_chats, read_chat_csv, read_profile_csv
+from north_star import iterate_date_range
+from polars_backend import HAS_POLARS, PolarsProcessor
+from processor import UniqueUsersProcessor
+from synthetic import make_chats, make_raw_events
+
+TABLES = [
+    'astrologer_hourly', 'overall_hourly',
+    'process_chat_intake_requests', 'process_chat_accepted_events', 'process_chat_completed_events',
+    'process_paid_chat_completed_events', 'process_chat_cancels', 'cancellation_time',
+    'process_overall_chat_completed_events', 'process_overall_chat_intake_requests',
+    'process_overall_chat_accepted_events', 'astros_live', 'users_live',
+]
+NORTH_STAR_RANGE = ('01-07-24', '30-10-24')
+# Averages are summed in a different order by each backend
+RTOL = 1e-9
+
+# Alternative backends by name: available flag and constructor taking the
+# export path or raw frame
+BACKENDS = {
+    'duckdb': (HAS_DUCKDB, DuckDBProcessor),
+    'polars': (HAS_POLARS, PolarsProcessor),
+}
+
+
+# Rows the synthetic generator never produces: missing ids on both sides of the
+# semi-joins, unparseable and non-object JSON, missing paid and times, other
+# time zone notations
+def edge_case_events():
+    rows = [
+        ('chat_intake_submit', '2024-11-20 10:05:00+00:00', None, '{"astrologerId": "a1"}'),
+        ('confirm_cancel_waiting_list', '2024-11-20 10:09:30+00:00', None, '{"astrologerId": "a1"}'),
+        ('chat_intake_submit', '2024-11-20 10:15:00+00:00', 'u1', '{"astrologerId": "a1"}'),
+        ('chat_intake_submit', '2024-11-20 16:00:00+05:30', 'u1', '{"astrologerId": "a1"}'),
+        ('confirm_cancel_waiting_list', '2024-11-20 10:45:00-01:00', 'u1', '{"astrologerId": "a1"}'),
+        ('confirm_cancel_waiting_list', None, 'u1', '{"astrologerId": "a1"}'),
+        ('chat_intake_submit', None, 'u2', '{"astrologerId": "a2"}'),
+        ('chat_intake_submit', '2024-11-20 23:59:59+00:00', 'u2', 'not json'),
+        ('chat_intake_submit', '2024-11-20 23:59:59+00:00', 'u3', '[1, 2]'),
+        ('accept_chat', '2024-11-20 10:20:00+00:00', 'a1', '{"clientId": null, "paid": 0, "chatSessionId": "s1"}'),
+        ('accept_chat', '2024-11-20 10:25:00+00:00', 'a1', '{"clientId": "u1", "chatSessionId": "s2"}'),
+        ('accept_chat', '2024-11-20 10:30:00+00:00', 'a1', '{"clientId": "u1", "paid": 1}'),
+        ('accept_chat', '2024-11-20 11:30:00+00:00', 'a2', '{"clientId": "u2", "paid": 0, "chatSessionId": "s3"}'),
+        ('chat_msg_send', '2024-11-20 10:21:00+00:00', 'u1', '{"chatSessionId": "s1"}'),
+        ('chat_msg_send', '2024-11-20 10:26:00+00:00', 'u1', '{"chatSessionId": "s2"}'),
+        ('chat_msg_send', '2024-11-20 10:31:00+00:00', 'u1', '{}'),
+        ('open_page', '2024-11-20 18:29:59+00:00', None, '{}'),
+        ('open_page', '2024-11-20 18:30:00+00:00', 'u4', '{}'),
+        ('app_open', '2024-11-20 18:30:00+00:00', 'u5', '{}'),
+    ]
+    return pd.DataFrame(rows, columns=['event_name', 'event_time', 'user_id', 'other_data'])
+
+
+def comparable(frame):
+    return frame.astype({'_id': str}) if '_id' in frame.columns else frame
+
+
+def cube_counts(processor, astro_df):
+    counts = HourlyCube.build(processor, astro_df).counts
+    return counts.astype({'_id': str}).sort_values(['_id', 'hour_key'], ignore_index=True)
+
+
+# Compute every table with the reference pandas processor and with the
+# backend, fail on the first difference and return both timings
+def check(name, make_processor, path, astro_df, cancellation_match):
+    timings = {}
+    started = time.perf_counter()
+    reference = UniqueUsersProcessor(encode_ids(extract_json(pd.read_csv(path), 'other_data')), astro_df, cancellation_match=cancellation_match)
+    expected = {table: getattr(reference, table)() for table in TABLES}
+    timings['pandas'] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    processor = make_processor(path, astro_df, cancellation_match=cancellation_match)
+    actual = {table: getattr(processor, table)() for table in TABLES}
+    timings[name] = time.perf_counter() - started
+
+    for table in TABLES:
+        try:
+            pd.testing.assert_frame_equal(comparable(actual[table]), comparable(expected[table]), rtol=RTOL)
+        except AssertionError as error:
+            raise AssertionError(f"{name} differs from pandas in {table} ({cancellation_match}): {error}") from None
+    pd.testing.assert_frame_equal(processor.merge_with_astro_data(actual['astrologer_hourly']), reference.merge_with_astro_data(expected['astrologer_hourly']), rtol=RTOL)
+    pd.testing.assert_frame_equal(cube_counts(processor, astro_df), cube_counts(reference, astro_df), rtol=RTOL)
+    return timings
+
+
+# The Polars North Star engine against the cumulative one on a synthetic chat export
+def check_north_star(rows, seed, directory):
+    chats_path, profiles_path = os.path.join(directory, 'chats.csv'), os.path.join(directory, 'profiles.csv')
+    chat_df, profile_df = make_chats(rows, seed)
+    chat_df.to_csv(chats_path, index=False)
+    profile_df.to_csv(profiles_path, index=False)
+    filtered_chat_df, profile_df = encode_ids(filter_chats(read_chat_csv(chats_path)), read_profile_csv(profiles_path))
+
+    timings, results = {}, {}
+    for mode in ['cumulative', 'polars']:
+        started = time.perf_counter()
+        results[mode] = iterate_date_range(filtered_chat_df, profile_df, *NORTH_STAR_RANGE, mode=mode)
+        timings[mode] = time.perf_counter() - started
+    pd.testing.assert_frame_equal(results['polars'], results['cumulative'])
+    print(f"polars   north star identical days; {rows:,} chats: cumulative {timings['cumulative']:.2f} s, polars {timings['polars']:.2f} s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check that the alternative metric backends return the pandas backend's tables, and time them")
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--backends', nargs='+', choices=list(BACKENDS), default=list(BACKENDS))
+    args = parser.parse_args()
+    warnings.simplefilter('ignore')
+
+    astro_df = load_astro_dimension()
+    with tempfile.TemporaryDirectory() as directory:
+        edge_path, synthetic_path = os.path.join(directory, 'edge_cases.csv'), os.path.join(directory, 'raw_data.csv')
+        edge_case_events().to_csv(edge_path, index=False)
+        make_raw_events(args.rows, args.seed).to_csv(synthetic_path, index=False)
+
+        for name in args.backends:
+            available, make_processor = BACKENDS[name]
+            if not available:
+                print(f"{name}: not installed, skipped")
+                continue
+            for cancellation_match in ['cartesian', 'latest']:
+                check(name, make_processor, edge_path, astro_df, cancellation_match)
+                timings = check(name, make_processor, synthetic_path, astro_df, cancellation_match)
+                print(f"{name:<8} {cancellation_match:<10} identical tables; {args.rows:,} rows: pandas {timings['pandas']:.2f} s, {name} {timings[name]:.2f} s "
+                      f"(x{timings['pandas'] / timings[name]:.1f})")
+            if name == 'polars':
+                check_north_star(args.rows, args.seed, directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,156 @@
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+import warnings
+from datetime import datetime, timezone
+
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from events import extract_json
+from ids import IdRegistry
+from ingest import filter_chats, read_chat_csv, read_profile_csv
+from instrumentation import StageRecorder
+from north_star import iterate_date_range
+from processor import UniqueUsersProcessor
+from streaming import read_events_streaming
+from synthetic import write_dataset
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.path.join(BENCH_DIR, 'data')
+RESULTS_PATH = os.path.join(BENCH_DIR, 'results.jsonl')
+# A stage slower than this ratio against the compared commit is flagged
+REGRESSION_RATIO = 1.10
+NORTH_STAR_RANGE = ('01-09-24', '30-09-24')
+ASTRO_COLUMNS = ['_id', 'name', 'type']
+
+
+def git_revision():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, check=True, capture_output=True, text=True).stdout.strip()
+        dirty = bool(subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=ROOT, check=True, capture_output=True, text=True).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown', False
+    return commit, dirty
+
+
+# Generated inputs are kept in DATA_DIR and reused for the same rows and seed
+def dataset(kind, rows, seed, chunk_rows):
+    os.makedirs(DATA_DIR, exist_ok=True)
+    path = os.path.join(DATA_DIR, f'{kind}_{rows}_{seed}.csv')
+    profiles_path = os.path.join(DATA_DIR, f'profiles_{rows}_{seed}.csv')
+    if not os.path.exists(path):
+        started = time.perf_counter()
+        write_dataset(kind, path + '.tmp', rows, seed, chunk_rows, profiles_path=profiles_path)
+        os.replace(path + '.tmp', path)
+        print(f"generated {path} ({os.path.getsize(path) / 2**20:,.0f} MiB) in {time.perf_counter() - started:.0f} s")
+    return path, profiles_path
+
+
+def hourly_tables(raw_df, fingerprint):
+    processor = UniqueUsersProcessor(raw_df, pd.DataFrame(columns=ASTRO_COLUMNS), cancellation_match='latest', fingerprint=fingerprint)
+    return processor.merge_with_astro_data(processor.astrologer_hourly()), processor.overall_hourly()
+
+
+def run_events(recorder, path, streaming, fingerprint):
+    raw_df = recorder.call('read_events', pd.read_csv, path)
+    raw_df = recorder.call('extract_json', extract_json, raw_df, 'other_data')
+    raw_df = recorder.call('encode_ids', IdRegistry().encode, raw_df)
+    recorder.call('hourly_tables', hourly_tables, raw_df, fingerprint)
+    del raw_df
+    if streaming:
+        recorder.call('streaming_read', read_events_streaming, path)
+
+
+def run_chats(recorder, path, profiles_path):
+    chat_df = recorder.call('read_chats', read_chat_csv, path)
+    profile_df = recorder.call('read_profiles', read_profile_csv, profiles_path)
+    filtered_chat_df, profile_df = recorder.call('filter_encode', lambda chats: IdRegistry().encode(filter_chats(chats), profile_df), chat_df)
+    recorder.call('north_star', iterate_date_range, filtered_chat_df, profile_df, *NORTH_STAR_RANGE)
+
+
+def print_stages(records):
+    for record in records:
+        peak = f"{record['peak_mib']:8.1f}" if record['peak_mib'] is not None else '       -'
+        print(f"  {record['stage']:<18} {record['seconds']:8.2f} s  cpu {record['cpu_seconds']:8.2f} s  peak {peak} MiB  rows {record['rows_in']} -> {record['rows_out']}")
+
+
+def load_results(path=RESULTS_PATH):
+    if not os.path.exists(path):
+        return []
+    with open(path) as handle:
+        return [json.loads(line) for line in handle if line.strip()]
+
+
+# Median seconds per (rows, seed, stage) for one commit
+def stage_times(results, commit):
+    frame = pd.DataFrame([result for result in results if result['commit'] == commit])
+    if frame.empty:
+        return {}
+    return frame.groupby(['rows', 'seed', 'stage'])['seconds'].median().to_dict()
+
+
+def compare(results, commit, baseline):
+    current, previous = stage_times(results, commit), stage_times(results, baseline)
+    print(f"\n{commit} vs {baseline}")
+    for key in sorted(current):
+        if key in previous:
+            ratio = current[key] / previous[key] if previous[key] else float('inf')
+            flag = '  REGRESSION' if ratio > REGRESSION_RATIO else ''
+            print(f"  rows {key[0]:>12,} {key[2]:<18} {previous[key]:8.2f} s -> {current[key]:8.2f} s  x{ratio:5.2f}{flag}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time every pipeline stage on seeded synthetic exports and keep the results per commit")
+    parser.add_argument('--rows', type=float, nargs='+', default=[1e5], help="scales to run, e.g. 1e5 1e6 1e7 (up to 1e8)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--suites', nargs='+', choices=['events', 'chats'], default=['events', 'chats'])
+    parser.add_argument('--repeat', type=int, default=1)
+    parser.add_argument('--streaming', action='store_true', help="also time the chunked event reader")
+    parser.add_argument('--no-trace-memory', action='store_true', help="skip tracemalloc (it slows large runs down)")
+    parser.add_argument('--chunk-rows', type=int, default=1_000_000, help="rows generated per chunk when writing inputs")
+    parser.add_argument('--results', default=RESULTS_PATH)
+    parser.add_argument('--compare', metavar='COMMIT', help="compare against stored results of this commit (default: the previous commit with results)")
+    args = parser.parse_args()
+    warnings.simplefilter('ignore')
+
+    commit, dirty = git_revision()
+    run_info = {'commit': commit, 'dirty': dirty, 'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+                'host': platform.node(), 'python': platform.python_version(), 'pandas': pd.__version__, 'seed': args.seed}
+    new_results = []
+    for rows in [int(rows) for rows in args.rows]:
+        for repeat in range(args.repeat):
+            for suite in args.suites:
+                print(f"{suite}, {rows:,} rows, run {repeat + 1}/{args.repeat}")
+                recorder = StageRecorder(trace_memory=not args.no_trace_memory)
+                if suite == 'events':
+                    path, _ = dataset('events', rows, args.seed, args.chunk_rows)
+                    run_events(recorder, path, args.streaming, fingerprint=f'{commit}-{rows}-{args.seed}-{repeat}')
+                else:
+                    path, profiles_path = dataset('chats', rows, args.seed, args.chunk_rows)
+                    run_chats(recorder, path, profiles_path)
+                print_stages(recorder.records())
+                new_results += [{**run_info, 'rows': rows, 'suite': suite, **record} for record in recorder.records()]
+    print(f"max RSS {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2**10:,.0f} MiB")
+
+    with open(args.results, 'a') as handle:
+        for result in new_results:
+            handle.write(json.dumps(result) + '\n')
+
+    results = load_results(args.results)
+    baseline = args.compare
+    if baseline is None:
+        earlier = [result['commit'] for result in results if result['commit'] != commit]
+        baseline = earlier[-1] if earlier else None
+    if baseline:
+        compare(results, commit, baseline)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+import json
+
+import numpy as np
+import pandas as pd
+
+EVENT_MIX = {
+    'chat_intake_submit': 0.12,
+    'confirm_cancel_waiting_list': 0.04,
+    'accept_chat': 0.12,
+    'chat_msg_send': 0.30,
+    'open_page': 0.22,
+    'app_open': 0.12,
+    'click_banner': 0.08,
+}
+
+
+def object_ids(rng, n):
+    return np.array([f"{value:024x}" for value in rng.integers(0, 2**63, n)], dtype=object)
+
+
+# Raw event export shaped like raw_data.csv: user_id is the acting user (the
+# astrologer for accept_chat), the rest of the ids live in the other_data JSON
+def make_raw_events(rows, seed=0, days=7, users=None, astrologers=150):
+    rng = np.random.default_rng(seed)
+    users = users or max(rows // 25, 10)
+    user_ids, astrologer_ids = object_ids(rng, users), object_ids(rng, astrologers)
+    session_ids = object_ids(rng, max(rows // 8, 10))
+    return _raw_events(rng, rows, days, user_ids, astrologer_ids, session_ids)
+
+
+def _raw_events(rng, rows, days, user_ids, astrologer_ids, session_ids):
+    names = rng.choice(list(EVENT_MIX), rows, p=np.array(list(EVENT_MIX.values())) / sum(EVENT_MIX.values()))
+    event_time = pd.Timestamp('2024-11-20', tz='UTC') + pd.to_timedelta(rng.integers(0, days * 86_400_000, rows), unit='ms')
+    users_col, astros_col = rng.choice(user_ids, rows), rng.choice(astrologer_ids, rows)
+    sessions_col, paid_col = rng.choice(session_ids, rows), rng.choice([0, 0, 0, 1], rows)
+
+    other_data = []
+    for name, user, astro, session, paid in zip(names, users_col, astros_col, sessions_col, paid_col):
+        if name == 'accept_chat':
+            data = {'clientId': user, 'paid': int(paid), 'chatSessionId': session}
+        elif name == 'chat_msg_send':
+            data = {'clientId': user, 'chatSessionId': session, 'messageType': 'text'}
+        elif name in ('chat_intake_submit', 'confirm_cancel_waiting_list'):
+            data = {'astrologerId': astro, 'source': 'home'}
+        else:
+            data = {'screen': 'home', 'appVersion': '3.2.1'}
+        other_data.append(json.dumps(data))
+
+    return pd.DataFrame({
+        'event_name': names,
+        'event_time': event_time.strftime('%Y-%m-%d %H:%M:%S.%f').str[:-3] + '+00:00',
+        'user_id': np.where(names == 'accept_chat', astros_col, users_col),
+        'other_data': other_data,
+        'platform': rng.choice(['android', 'ios'], rows),
+    })
+
+
+END_REASONS = {'USER_ENDED': 0.45, 'ASTROLOGER_ENDED': 0.25, 'TIMEOUT': 0.12, 'LOW_BALANCE': 0.08, 'NOT_STARTED': 0.10}
+CHAT_START = pd.Timestamp('2024-06-01', tz='UTC')
+CHAT_DAYS = 150
+
+
+# Chat export as read by north-star-metrix.py: each user chats a few times
+# (geometric), hasFreeMins is mostly 0 with some blanks, createdAt is ISO 8601 UTC
+def _chats(rng, rows, user_ids, astrologer_ids, days=CHAT_DAYS):
+    # Skewed users: a few heavy chatters, a long tail of one or two chats
+    user_col = user_ids[(rng.geometric(4 / len(user_ids), rows) - 1) % len(user_ids)]
+    created = CHAT_START + pd.to_timedelta(rng.integers(0, days * 86_400_000, rows), unit='ms')
+    has_free_mins = rng.choice([0.0, 0.0, 0.0, 1.0, np.nan], rows)
+    return pd.DataFrame({
+        '_id': object_ids(rng, rows),
+        'userId': user_col,
+        'astrologerId': rng.choice(astrologer_ids, rows),
+        'createdAt': created.strftime('%Y-%m-%dT%H:%M:%S.%f').str[:-3] + 'Z',
+        'hasFreeMins': has_free_mins,
+        'endReason': rng.choice(list(END_REASONS), rows, p=list(END_REASONS.values())),
+        'status': rng.choice(['COMPLETED', 'CANCELLED'], rows, p=[0.85, 0.15]),
+        'type': rng.choice(['FREE', 'PAID'], rows, p=[0.7, 0.3]),
+        'duration': rng.integers(0, 3600, rows),
+    })
+
+
+# Profile export: one row per user, signed up over the months before and
+# during the chat window
+def _profiles(rng, user_ids, days=CHAT_DAYS):
+    created = CHAT_START - pd.Timedelta(days=90) + pd.to_timedelta(rng.integers(0, (days + 90) * 86_400_000, len(user_ids)), unit='ms')
+    return pd.DataFrame({
+        '_id': user_ids,
+        'createdAt': created.strftime('%Y-%m-%dT%H:%M:%S.%f').str[:-3] + 'Z',
+        'gender': rng.choice(['male', 'female', 'other'], len(user_ids)),
+        'language': rng.choice(['hi', 'en', 'ta', 'te', 'bn'], len(user_ids)),
+    })
+
+
+def make_chats(rows, seed=0, users=None, astrologers=150):
+    rng = np.random.default_rng(seed)
+    user_ids, astrologer_ids = object_ids(rng, users or max(rows // 10, 10)), object_ids(rng, astrologers)
+    return _chats(rng, rows, user_ids, astrologer_ids), _profiles(rng, user_ids)
+
+
+# Write a dataset of any size chunk by chunk: id pools come from `seed`, each
+# chunk of rows from (seed, chunk number), so the files are reproducible and
+# never need more than one chunk in memory. kind is 'events' or 'chats'; chats
+# also writes profiles_path.
+def write_dataset(kind, path, rows, seed=0, chunk_rows=1_000_000, profiles_path=None, days=7, astrologers=150):
+    rng = np.random.default_rng(seed)
+    astrologer_ids = object_ids(rng, astrologers)
+    if kind == 'events':
+        user_ids, session_ids = object_ids(rng, max(rows // 25, 10)), object_ids(rng, max(rows // 8, 10))
+        make_chunk = lambda chunk_rng, n: _raw_events(chunk_rng, n, days, user_ids, astrologer_ids, session_ids)
+    elif kind == 'chats':
+        user_ids = object_ids(rng, max(rows // 10, 10))
+        _profiles(rng, user_ids).to_csv(profiles_path, index=False)
+        make_chunk = lambda chunk_rng, n: _chats(chunk_rng, n, user_ids, astrologer_ids)
+    else:
+        raise ValueError(f"Unknown dataset kind: {kind}")
+
+    for chunk, start in enumerate(range(0, rows, chunk_rows)):
+        frame = make_chunk(np.random.default_rng([seed, chunk]), min(chunk_rows, rows - start))
+        frame.to_csv(path, index=False, mode='w' if chunk == 0 else 'a', header=chunk == 0)
@@ -0,0 +1,71 @@
+import numpy as np
+import pandas as pd
+
+# Per-astrologer charts are aggregated here before anything reaches the browser:
+# at most TOP_SERIES astrologers by volume plus an "Others" line, at most
+# MAX_POINTS points in total, and WebGL traces once a chart has more than
+# WEBGL_POINTS points.
+TOP_SERIES = 10
+OTHERS = 'Others'
+MAX_POINTS = 20_000
+WEBGL_POINTS = 2_000
+
+# x axes a chart can be drawn on: hour of day (summed over dates), calendar
+# date, or the full date-and-hour timeline
+X_AXES = {'hour': 'Hour', 'date': 'Date', 'time': 'Date and hour'}
+
+
+def _with_x(frame, x):
+    if x == 'time':
+        return frame.assign(time=pd.to_datetime(frame['date']) + pd.to_timedelta(frame['hour'], unit='h'))
+    return frame
+
+
+# Coarsen the x axis to at most `buckets` distinct values, each labelled by its
+# first x value
+def _bucket_x(values, buckets):
+    unique = np.sort(values.dropna().unique())
+    if len(unique) <= buckets:
+        return values
+    step = -(-len(unique) // buckets)
+    position = np.searchsorted(unique, values.to_numpy())
+    return pd.Series(unique[(position // step) * step], index=values.index)
+
+
+# Long table (series, x, y) ready to plot: rows are summed (or averaged) per
+# series and x, series outside the top_n by total y are folded into OTHERS
+# (top_n=None keeps all), and x is coarsened so the total stays within
+# max_points
+def chart_data(frame, y, x='hour', by='name', top_n=TOP_SERIES, agg='sum', max_points=MAX_POINTS):
+    frame = _with_x(frame, x)[[by, x, y]]
+    series = frame[by].astype(object).fillna('Unknown')
+    if top_n is not None:
+        totals = frame[y].groupby(series).sum().sort_values(ascending=False, kind='stable')
+        series = series.where(series.isin(totals.index[:top_n]), OTHERS)
+    frame = frame.assign(**{by: series})
+
+    n_series = max(frame[by].nunique(), 1)
+    frame[x] = _bucket_x(frame[x], max(max_points // n_series, 1))
+    data = frame.groupby([by, x], sort=True)[y].agg(agg).reset_index()
+
+    # Keep the Others line last and the named series in order of volume
+    order = data.groupby(by)[y].sum().sort_values(ascending=False, kind='stable').index.tolist()
+    if OTHERS in order:
+        order.remove(OTHERS)
+        order.append(OTHERS)
+    data[by] = pd.Categorical(data[by], categories=order)
+    return data.sort_values([by, x], kind='stable').reset_index(drop=True)
+
+
+# Line chart of chart_data(...): one trace per series, Scattergl above
+# webgl_points points
+def line_chart(frame, y, title, x='hour', by='name', top_n=TOP_SERIES, agg='sum', max_points=MAX_POINTS, webgl_points=WEBGL_POINTS, yaxis_title=None):
+    import plotly.graph_objects as go
+
+    data = chart_data(frame, y, x=x, by=by, top_n=top_n, agg=agg, max_points=max_points)
+    trace = go.Scattergl if len(data) > webgl_points else go.Scatter
+    fig = go.Figure()
+    for name, points in data.groupby(by, observed=True, sort=True):
+        fig.add_trace(trace(x=points[x], y=points[y], mode='lines', name=str(name), connectgaps=False))
+    fig.update_layout(title=title, xaxis_title=X_AXES.get(x, x), yaxis_title=yaxis_title or y, legend_title_text=by)
+    return fig
@@ -0,0 +1,130 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from dataset_cache import frame_fingerprint
+from hll import SketchTable
+from processor import astro_lookup
+
+# Distinct-count metrics kept as sketches; each also gets an additive event count
+CUBE_METRICS = ['chat_intake_requests', 'chat_accepted', 'chat_completed', 'paid_chats_completed', 'cancelled_requests']
+CELL_KEYS = ['_id', 'type', 'hour_key']
+DEFAULT_CUBE_PATH = 'hourly_cube.pkl'
+
+
+# Derive the roll-up dimensions a query can group by from a frame with hour_key
+def _with_dimensions(frame, by):
+    day = frame['hour_key'] // 24
+    derived = {
+        'date': lambda: pd.to_datetime(day, unit='D').dt.date,
+        'hour': lambda: (frame['hour_key'] % 24).astype('int32'),
+        'week': lambda: (pd.to_datetime(day, unit='D') - pd.to_timedelta(pd.to_datetime(day, unit='D').dt.dayofweek, unit='D')).dt.date,
+    }
+    return frame.assign(**{column: derived[column]() for column in by if column in derived})
+
+
+# Sketch table without the sketches of hours low..high
+def _drop_hours(sketch, low, high):
+    keep = ~sketch.keys['hour_key'].between(low, high).to_numpy()
+    position = np.cumsum(keep) - 1
+    cells = sketch.cells[keep[sketch.cells['sketch'].to_numpy()]]
+    return SketchTable(sketch.keys[keep], cells.assign(sketch=position[cells['sketch'].to_numpy()]), sketch.precision)
+
+
+# Materialized per-(astrologer, type, IST hour) aggregates: additive event counts,
+# cancellation time sums and mergeable HyperLogLog sketches for the distinct
+# counts. Any roll-up over _id, type, date, week and hour is answered from the
+# cube alone.
+class HourlyCube:
+    def __init__(self, counts, sketches):
+        self.counts = counts
+        self.sketches = sketches
+
+    # Memoized on the processor's dataset fingerprint and the astrologer types
+    @classmethod
+    def build(cls, processor, astro_df):
+        types = astro_lookup(astro_df)['type']
+        return processor.memoized(('hourly_cube', frame_fingerprint(types.reset_index())), lambda: cls._build(processor, types))
+
+    @classmethod
+    def _build(cls, processor, types):
+        counts = []
+        sketches = {}
+        for name in CUBE_METRICS:
+            spec = processor.metrics[name]
+            rows = getattr(processor, spec.select)()
+            rows = rows[rows['hour_key'] >= 0]
+            events = rows.groupby([spec.entity, 'hour_key'], observed=True).size().rename(f'{name}_events')
+            counts.append(events.rename_axis(['_id', 'hour_key']))
+            sketch = processor.metric_sketches(name)
+            sketches[name] = sketch.assign_keys(type=sketch.keys['_id'].map(types)).rollup(CELL_KEYS)
+
+        pairs = processor.cancellation_pairs().dropna(subset=['time_diff'])
+        time_diff = pairs.groupby(['astrologerId', 'hour_key'], observed=True)['time_diff'].agg(['sum', 'count'])
+        time_diff.columns = ['time_diff_sum', 'time_diff_count']
+        counts.append(time_diff.rename_axis(['_id', 'hour_key']))
+
+        counts = pd.concat(counts, axis=1).fillna(0).reset_index()
+        counts.insert(1, 'type', counts['_id'].map(types))
+        return cls(counts, sketches)
+
+    # Cubes built from different days or chunks combine without raw events
+    def merge(self, other):
+        counts = pd.concat([self.counts, other.counts], ignore_index=True)
+        measures = [column for column in counts.columns if column not in CELL_KEYS]
+        counts[measures] = counts[measures].fillna(0)
+        counts = counts.groupby(CELL_KEYS, dropna=False, sort=True, observed=True)[measures].sum().reset_index()
+        sketches = {name: self.sketches[name].merge(other.sketches[name]) for name in self.sketches}
+        return HourlyCube(counts, sketches)
+
+    def save(self, path=DEFAULT_CUBE_PATH):
+        pd.to_pickle({'counts': self.counts, 'sketches': {name: (sketch.keys, sketch.cells, sketch.precision) for name, sketch in self.sketches.items()}}, path)
+
+    @classmethod
+    def load(cls, path=DEFAULT_CUBE_PATH):
+        data = pd.read_pickle(path)
+        return cls(data['counts'], {name: SketchTable(*parts) for name, parts in data['sketches'].items()})
+
+    # This cube's cells replaced by other's over the hours other spans (first to
+    # last hour_key), so a later export covering the same days supersedes the
+    # earlier one instead of being added to it
+    def update(self, other):
+        if other.counts.empty:
+            return self
+        low, high = other.counts['hour_key'].min(), other.counts['hour_key'].max()
+        counts = self.counts[~self.counts['hour_key'].between(low, high)]
+        sketches = {name: _drop_hours(sketch, low, high) for name, sketch in self.sketches.items()}
+        return HourlyCube(counts, sketches).merge(other)
+
+    # Update the cube stored at path with this one, save and return the result
+    def save_merged(self, path=DEFAULT_CUBE_PATH):
+        cube = HourlyCube.load(path).update(self) if os.path.exists(path) else self
+        cube.save(path)
+        return cube
+
+    # Roll up to any of '_id', 'type', 'date', 'week', 'hour' (hour of day);
+    # by=[] gives one row for the whole cube. Distinct counts are HLL estimates,
+    # *_events are exact event counts and active_astrologers is exact.
+    def rollup(self, by):
+        by = list(by)
+        counts = _with_dimensions(self.counts, by)
+        if by:
+            grouped = counts.groupby(by, dropna=False, sort=True, observed=True)
+            table = grouped[[column for column in self.counts.columns if column not in CELL_KEYS]].sum()
+            table['active_astrologers'] = grouped['_id'].nunique()
+            table = table.reset_index()
+        else:
+            table = counts.drop(columns=CELL_KEYS).sum().to_frame().T
+            table['active_astrologers'] = counts['_id'].nunique()
+        with np.errstate(invalid='ignore', divide='ignore'):
+            table['avg_time_diff_minutes'] = table.pop('time_diff_sum') / table.pop('time_diff_count').replace(0, np.nan)
+
+        for name, sketch in self.sketches.items():
+            keyed = SketchTable(_with_dimensions(sketch.keys, by), sketch.cells, sketch.precision)
+            if by:
+                estimates = keyed.rollup(by).to_frame(name)
+                table = table.merge(estimates, on=by, how='left')
+            else:
+                table[name] = keyed.assign_keys(all=0).rollup(['all']).to_frame(name)[name].iloc[0] if len(keyed.keys) else 0
+        return table
@@ -0,0 +1,131 @@
+import hashlib
+import importlib.util
+import io
+import os
+import tempfile
+
+import pandas as pd
+
+CACHE_DIR = os.environ.get('NSM_CACHE_DIR', '.dataset_cache')
+CACHE_MAX_BYTES = int(os.environ.get('NSM_CACHE_MAX_BYTES', 8 * 2**30))
+# Part of every cache key: bump it when a reader or the stored layout changes
+# what a cached file holds, so files written by older code are not used
+CACHE_FORMAT_VERSION = 1
+
+HAS_PYARROW = importlib.util.find_spec('pyarrow') is not None
+
+
+def _read_bytes(file):
+    if hasattr(file, 'getvalue'):
+        return file.getvalue()
+    if hasattr(file, 'read'):
+        data = file.read()
+        if hasattr(file, 'seek'):
+            file.seek(0)
+        return data
+    with open(file, 'rb') as handle:
+        return handle.read()
+
+
+def content_key(data, reader):
+    digest = hashlib.blake2b(data, digest_size=20)
+    # Different readers produce different frames from the same bytes
+    digest.update(f"{CACHE_FORMAT_VERSION}:{reader.__module__}.{reader.__qualname__}".encode())
+    return digest.hexdigest()
+
+
+# Identity of an upload's bytes, e.g. to memoize results derived from it
+def file_fingerprint(file):
+    return hashlib.blake2b(_read_bytes(file), digest_size=20).hexdigest()
+
+
+# Identity of a file on disk by path, size and modification time, for
+# exports too large to hash
+def path_fingerprint(path):
+    stat = os.stat(path)
+    return f"{os.path.abspath(path)}:{stat.st_size}:{stat.st_mtime_ns}"
+
+
+# Identity of a frame's contents (and column names/dtypes); costs a pass over
+# the data, so prefer file_fingerprint when the source file is at hand
+def frame_fingerprint(frame):
+    digest = hashlib.blake2b(digest_size=20)
+    if isinstance(frame, pd.DataFrame):
+        digest.update(repr([(str(column), str(dtype)) for column, dtype in frame.dtypes.items()]).encode())
+    digest.update(pd.util.hash_pandas_object(frame, index=False).to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+# Keep the cache directory under max_bytes, dropping least recently used files
+def evict(cache_dir=CACHE_DIR, max_bytes=CACHE_MAX_BYTES):
+    if not os.path.isdir(cache_dir):
+        return
+    entries = []
+    for name in os.listdir(cache_dir):
+        if name.endswith('.feather'):
+            stat = os.stat(os.path.join(cache_dir, name))
+            entries.append((stat.st_mtime, stat.st_size, name))
+    total = sum(size for _, size, _ in entries)
+    for _, size, name in sorted(entries):
+        if total <= max_bytes:
+            break
+        os.remove(os.path.join(cache_dir, name))
+        total -= size
+
+
+# Memory-map a cached file. It is stored as one record batch, so numeric
+# columns without missing values are read-only views of the mapped file
+# rather than copies; other columns are converted one at a time.
+def _read_feather(path):
+    from pyarrow import feather
+
+    return feather.read_table(path, memory_map=True).to_pandas(split_blocks=True, self_destruct=True)
+
+
+# Load an uploaded CSV through `reader`, caching the typed result as an
+# uncompressed Feather file keyed by the upload's content hash. Later loads of
+# the same bytes memory-map that file instead of parsing the CSV again. The
+# first load returns the file read back as well, so every load of the same
+# bytes gives the same frame (e.g. None rather than NaN for missing strings).
+def load_cached_csv(file, reader=pd.read_csv, cache_dir=CACHE_DIR, max_bytes=CACHE_MAX_BYTES):
+    if not HAS_PYARROW:
+        return reader(file)
+    from pyarrow import ArrowException, feather
+
+    data = _read_bytes(file)
+    path = os.path.join(cache_dir, content_key(data, reader) + '.feather')
+    if os.path.exists(path):
+        try:
+            os.utime(path)  # mark as recently used
+            return _read_feather(path)
+        except (ArrowException, OSError, ValueError):
+            # Unreadable (e.g. left by a crash or evicted meanwhile): drop it and parse again
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    frame = reader(io.BytesIO(data))
+    os.makedirs(cache_dir, exist_ok=True)
+    # A temp file of its own per writer: sessions are threads of one process
+    # and may load the same upload at once; os.replace installs a whole file
+    handle, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+    os.close(handle)
+    try:
+        feather.write_feather(frame.reset_index(drop=True), tmp_path, compression='uncompressed', chunksize=max(len(frame), 1))
+        os.replace(tmp_path, path)
+    except (ArrowException, OSError, ValueError, TypeError):
+        # Columns with mixed Python types cannot be stored, or the disk is
+        # full or read-only; just skip caching
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return frame
+    del frame
+    # Mapped before eviction, which may drop a file larger than the whole budget
+    try:
+        frame = _read_feather(path)
+    except (ArrowException, OSError, ValueError):
+        # Evicted by another session in between
+        return reader(io.BytesIO(data))
+    evict(cache_dir, max_bytes)
+    return frame
@@ -0,0 +1,166 @@
+from functools import cached_property
+
+import pandas as pd
+
+from dataset_cache import path_fingerprint
+from events import EVENT_JSON_KEYS, NUMERIC_JSON_KEYS
+from hll import DEFAULT_PRECISION
+from ids import encode_ids
+from metric_engine import finish_hourly_table
+from processor import EVENT_ID_COLUMNS, METRIC_EVENTS, TIMED_EVENTS, UniqueUsersProcessor
+
+try:
+    import duckdb
+except ImportError:
+    duckdb = None
+
+HAS_DUCKDB = duckdb is not None
+
+# Row selections of UniqueUsersProcessor as SQL views over `events`, in
+# dependency order. Semi-joins use IS NOT DISTINCT FROM because pandas isin
+# matches missing ids to missing ids.
+SELECTIONS = {
+    'intake_events': "SELECT * FROM events WHERE event_name = 'chat_intake_submit'",
+    'cancel_events': "SELECT * FROM events WHERE event_name = 'confirm_cancel_waiting_list'",
+    'accept_events': "SELECT * FROM events WHERE event_name = 'accept_chat'",
+    'open_page_events': "SELECT * FROM events WHERE event_name = 'open_page'",
+    'free_accepts_from_intake_users': """
+        SELECT a.* FROM accept_events a SEMI JOIN intake_events i ON a.clientId IS NOT DISTINCT FROM i.user_id
+        WHERE a.paid = 0""",
+    'completed_accepts': """
+        SELECT a.* FROM accept_events a
+        SEMI JOIN (SELECT chatSessionId FROM events WHERE event_name = 'chat_msg_send') s ON a.chatSessionId IS NOT DISTINCT FROM s.chatSessionId""",
+    'free_completed_accepts': "SELECT * FROM completed_accepts WHERE paid = 0",
+    'paid_completed_accepts': "SELECT * FROM completed_accepts WHERE paid IS DISTINCT FROM 0",
+}
+TIME_DIFF = "(epoch_us(c.event_time) - epoch_us(i.event_time)) / 1000000.0 / 60.0 AS time_diff"
+CANCELLATION_PAIRS = {
+    'cartesian': f"""
+        SELECT i.user_id, i.astrologerId, i.hour_key, {TIME_DIFF}
+        FROM intake_events i JOIN cancel_events c
+        ON i.user_id IS NOT DISTINCT FROM c.user_id AND i.astrologerId IS NOT DISTINCT FROM c.astrologerId
+        WHERE i.hour_key >= 0""",
+    'latest': f"""
+        SELECT i.user_id, i.astrologerId, i.hour_key, {TIME_DIFF}
+        FROM (SELECT * FROM cancel_events WHERE user_id IS NOT NULL AND astrologerId IS NOT NULL AND event_time IS NOT NULL) c
+        ASOF JOIN (SELECT * FROM intake_events WHERE hour_key >= 0 AND user_id IS NOT NULL AND astrologerId IS NOT NULL) i
+        ON c.user_id = i.user_id AND c.astrologerId = i.astrologerId AND c.event_time >= i.event_time""",
+}
+AGGREGATES = {
+    ('nunique', 'exact'): 'COUNT(DISTINCT "{column}")',
+    ('nunique', 'hll'): 'approx_count_distinct("{column}")',
+    ('mean', 'exact'): 'AVG("{column}")',
+    ('mean', 'hll'): 'AVG("{column}")',
+}
+
+
+def _source_columns(connection):
+    return connection.sql("SELECT * FROM raw_events LIMIT 0").columns
+
+
+# One row per relevant event with the columns prepare_events produces:
+# ids as text, paid as a number, event_time in IST for the timed events and
+# hour_key (-1 without a time). Keys missing from the source columns are read
+# from the other_data JSON as extract_json would.
+def events_sql(columns):
+    from_json = [key for key in EVENT_JSON_KEYS if key not in columns] if 'other_data' in columns else []
+    select = ['event_name']
+    for column in EVENT_ID_COLUMNS + ['paid']:
+        cast = 'DOUBLE' if column in NUMERIC_JSON_KEYS else 'VARCHAR'
+        if column in columns:
+            value = f'"{column}"'
+        elif column in from_json:
+            value = f'json_values[{from_json.index(column) + 1}]'
+        else:
+            value = 'NULL'
+        select.append(f'TRY_CAST({value} AS {cast}) AS "{column}"')
+    timed = ', '.join(f"'{name}'" for name in TIMED_EVENTS)
+    select.append(f"CASE WHEN event_name IN ({timed}) THEN TRY_CAST(event_time AS TIMESTAMPTZ) + INTERVAL 330 MINUTE END AS event_time")
+    json_values = ''
+    if from_json:
+        paths = ', '.join(f"'$.{key}'" for key in from_json)
+        json_values = f", CASE WHEN json_valid(other_data) THEN json_extract_string(other_data, [{paths}]) END AS json_values"
+    relevant = ', '.join(f"'{name}'" for name in METRIC_EVENTS)
+    return f"""
+        SELECT *, CAST(((hour_key % 24) + 24) % 24 AS TINYINT) AS hour FROM (
+            SELECT *, COALESCE(CAST(floor(epoch_us(event_time) / 3600000000) AS INTEGER), -1) AS hour_key FROM (
+                SELECT {', '.join(select)} FROM (SELECT *{json_values} FROM raw_events WHERE event_name IN ({relevant}))
+            )
+        )"""
+
+
+# UniqueUsersProcessor whose hourly tables are computed as SQL by an
+# in-process DuckDB connection: multithreaded, and spilling to temp_directory
+# when memory_limit is reached. source is an event export path (CSV, or
+# Parquet by extension; scanned without loading it into pandas) or a raw_df as
+# the pandas backend takes it, with or without extract_json applied. Tables
+# match the pandas backend's; with distinct='hll' the counts are DuckDB's own
+# approx_count_distinct estimates. Nodes the hourly cube reads (events,
+# selections, sketches) are materialized into pandas on first use.
+class DuckDBProcessor(UniqueUsersProcessor):
+    def __init__(self, source, astro_df, cancellation_match='cartesian', distinct='exact', hll_precision=DEFAULT_PRECISION, fingerprint=None,
+                 threads=None, memory_limit=None, temp_directory=None):
+        if duckdb is None:
+            raise ImportError("the DuckDB backend needs the duckdb package (pip install duckdb)")
+        raw_df = source if isinstance(source, pd.DataFrame) else None
+        super().__init__(raw_df, astro_df, cancellation_match, distinct, hll_precision, fingerprint)
+        self.source = source
+        self.config = {key: value for key, value in [('threads', threads), ('memory_limit', memory_limit), ('temp_directory', temp_directory)] if value is not None}
+
+    # File sources are identified by path, size and modification time rather
+    # than hashed, so large exports are not read just to key the memo
+    @cached_property
+    def fingerprint(self):
+        if self._fingerprint is None and self.raw_df is None:
+            return path_fingerprint(self.source)
+        return super().fingerprint
+
+    # Connection with the relevant events loaded once into a table and every
+    # selection defined as a view over it
+    @cached_property
+    def connection(self):
+        connection = duckdb.connect(config=self.config)
+        connection.execute("SET TimeZone = 'UTC'")
+        if self.raw_df is not None:
+            connection.register('raw_events', self.raw_df)
+        elif str(self.source).lower().endswith('.parquet'):
+            connection.read_parquet(str(self.source)).create_view('raw_events')
+        else:
+            connection.read_csv(str(self.source), header=True, all_varchar=True).create_view('raw_events')
+        connection.execute(f"CREATE TEMP TABLE events AS {events_sql(_source_columns(connection))}")
+        if self.raw_df is not None:
+            connection.unregister('raw_events')
+        for name, sql in SELECTIONS.items():
+            connection.execute(f"CREATE TEMP VIEW {name} AS {sql}")
+        connection.execute(f"CREATE TEMP VIEW cancellation_pairs AS {CANCELLATION_PAIRS[self.cancellation_match]}")
+        return connection
+
+    # Ids are interned as on the pandas path, so the nodes behave the same
+    @cached_property
+    def events(self):
+        events = self.connection.sql("SELECT * FROM events").df()
+        return encode_ids(events.astype({'hour_key': 'int32', 'hour': 'int8'}))
+
+    # Same wide table as metric_engine.hourly_metrics: one aggregate per spec
+    # over the (entity, hour_key) groups, outer-joined and sorted by entity
+    # then hour
+    def _hourly_metrics(self, specs):
+        if len({spec.entity is None for spec in specs}) > 1:
+            raise ValueError("cannot mix per-entity and dataset-wide metrics in one table")
+        per_entity = specs[0].entity is not None
+        keys = '_id, hour_key' if per_entity else 'hour_key'
+
+        metrics = []
+        for spec in specs:
+            if (spec.agg, self.distinct) not in AGGREGATES:
+                raise ValueError(f"Unknown aggregation: {spec.agg}")
+            entity = f'CAST("{spec.entity}" AS VARCHAR) AS _id, ' if per_entity else ''
+            present = f' AND "{spec.entity}" IS NOT NULL' if per_entity else ''
+            value = AGGREGATES[spec.agg, self.distinct].format(column=spec.column)
+            metrics.append(f"SELECT {entity}hour_key, {value} AS value FROM {spec.select} WHERE hour_key >= 0{present} GROUP BY ALL")
+
+        ctes = [f"m{index} AS ({sql})" for index, sql in enumerate(metrics)]
+        ctes.append("groups AS (" + " UNION ".join(f"SELECT {keys} FROM m{index}" for index in range(len(specs))) + ")")
+        joins = ''.join(f" LEFT JOIN m{index} USING ({keys})" for index in range(len(specs)))
+        values = ', '.join(f'm{index}.value AS "{spec.name}"' for index, spec in enumerate(specs))
+        return finish_hourly_table(self.connection.sql(f"WITH {', '.join(ctes)} SELECT {keys}, {values} FROM groups{joins} ORDER BY {keys}").df(), specs)
@@ -0,0 +1,52 @@
+import json
+
+import numpy as np
+import pandas as pd
+
+try:
+    import orjson
+    _loads = orjson.loads
+    _DECODE_ERRORS = (orjson.JSONDecodeError, TypeError)
+except ImportError:
+    _loads = json.loads
+    _DECODE_ERRORS = (json.JSONDecodeError, TypeError)
+
+# Keys of the other_data JSON that UniqueUsersProcessor reads; keys that are
+# already top-level columns of the export are left alone
+EVENT_JSON_KEYS = ['astrologerId', 'clientId', 'paid', 'chatSessionId', 'user_id']
+NUMERIC_JSON_KEYS = {'paid'}
+
+
+def _decode(values):
+    decoded = []
+    append = decoded.append
+    for item in values:
+        try:
+            data = _loads(item)
+        except _DECODE_ERRORS:
+            data = None
+        append(data if isinstance(data, dict) else None)
+    return decoded
+
+
+# Step 2: Expand the JSON column into typed columns aligned with raw_df. Rows
+# that fail to parse stay in place with nulls. keys=None expands every key
+# (nested ones flattened as with pd.json_normalize).
+def extract_json(raw_df, json_column, keys=EVENT_JSON_KEYS):
+    values = raw_df[json_column].to_numpy(dtype=object, na_value=None)
+    decoded = _decode(values)
+
+    if keys is None:
+        json_df = pd.json_normalize([data if data is not None else {} for data in decoded])
+        json_df.index = raw_df.index
+    else:
+        columns = {}
+        for key in [key for key in keys if key not in raw_df.columns]:
+            column = np.array([data.get(key) if data is not None else None for data in decoded], dtype=object)
+            if key in NUMERIC_JSON_KEYS:
+                columns[key] = pd.to_numeric(pd.Series(column, index=raw_df.index), errors='coerce')
+            else:
+                columns[key] = pd.Series(column, index=raw_df.index)
+        json_df = pd.DataFrame(columns, index=raw_df.index)
+
+    return pd.concat([raw_df, json_df], axis=1)
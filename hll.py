@@ -0,0 +1,92 @@
+import numpy as np
+import pandas as pd
+
+# HyperLogLog distinct counting. With precision p each sketch has m = 2**p
+# registers and the estimate has a relative standard error of about
+# 1.04 / sqrt(m): p=10 -> 3.3%, p=12 -> 1.6%, p=14 -> 0.8%. Sketches merge by
+# taking the register-wise maximum, so partial results from chunks, hours or
+# workers combine without the raw events. Registers are stored sparsely (only
+# non-zero ones), so a sketch costs at most min(distinct values, m) cells.
+DEFAULT_PRECISION = 12
+
+
+def relative_error(precision=DEFAULT_PRECISION):
+    return 1.04 / np.sqrt(2 ** precision)
+
+
+def _bit_length(values):
+    # Exact bit length of uint64 values: frexp is exact on each 32-bit half
+    high = (values >> np.uint64(32)).astype(np.float64)
+    low = (values & np.uint64(0xFFFFFFFF)).astype(np.float64)
+    return np.where(high > 0, np.frexp(high)[1] + 32, np.frexp(low)[1])
+
+
+def _alpha(m):
+    return {16: 0.673, 32: 0.697, 64: 0.709}.get(m, 0.7213 / (1 + 1.079 / m))
+
+
+# A table of sketches: one row of `keys` (e.g. _id, hour_key) per sketch and
+# the non-zero registers in `cells` (sketch row, register, rho)
+class SketchTable:
+    def __init__(self, keys, cells, precision=DEFAULT_PRECISION):
+        self.keys = keys.reset_index(drop=True)
+        self.cells = cells.reset_index(drop=True)
+        self.precision = precision
+
+    @classmethod
+    def from_rows(cls, keys, values, precision=DEFAULT_PRECISION):
+        columns = list(keys.columns)
+        grouped = keys.groupby(columns, sort=True, dropna=True)
+        sketch = grouped.ngroup().to_numpy()
+        unique_keys = grouped.size().index.to_frame(index=False)
+
+        values = np.asarray(values, dtype=object)
+        keep = (sketch >= 0) & pd.notna(values)
+        hashes = pd.util.hash_array(values[keep])
+        rest = hashes & np.uint64((1 << (64 - precision)) - 1)
+        cells = pd.DataFrame({
+            'sketch': sketch[keep].astype(np.int64),
+            'register': (hashes >> np.uint64(64 - precision)).astype(np.int32),
+            'rho': ((64 - precision) - _bit_length(rest) + 1).astype(np.uint8),
+        })
+        return cls(unique_keys, cls._max_cells(cells), precision)
+
+    @staticmethod
+    def _max_cells(cells):
+        return cells.groupby(['sketch', 'register'], sort=False)['rho'].max().reset_index()
+
+    # Combine sketches whose new keys are equal (register-wise max)
+    def _regroup(self, keys):
+        grouped = keys.groupby(list(keys.columns), sort=True, dropna=False)
+        new_sketch = grouped.ngroup().to_numpy()
+        cells = self.cells.assign(sketch=new_sketch[self.cells['sketch'].to_numpy()])
+        return SketchTable(grouped.size().index.to_frame(index=False), self._max_cells(cells), self.precision)
+
+    def merge(self, other):
+        if other.precision != self.precision:
+            raise ValueError("cannot merge sketches of different precision")
+        keys = pd.concat([self.keys, other.keys], ignore_index=True)
+        cells = pd.concat([self.cells, other.cells.assign(sketch=other.cells['sketch'] + len(self.keys))], ignore_index=True)
+        return SketchTable(keys, cells, self.precision)._regroup(keys)
+
+    # Re-key sketches (e.g. add a day column from hour_key) before a roll-up
+    def assign_keys(self, **columns):
+        return SketchTable(self.keys.assign(**columns), self.cells, self.precision)
+
+    # Roll up to a subset of the key columns, e.g. hour -> day -> week
+    def rollup(self, by):
+        return self._regroup(self.keys[list(by)])
+
+    def estimate(self):
+        m = 2 ** self.precision
+        sketch = self.cells['sketch'].to_numpy()
+        filled = np.bincount(sketch, minlength=len(self.keys))
+        harmonic = np.bincount(sketch, weights=np.power(2.0, -self.cells['rho'].to_numpy(np.float64)), minlength=len(self.keys))
+        zeros = m - filled
+        raw = _alpha(m) * m * m / (harmonic + zeros)
+        with np.errstate(divide='ignore'):
+            linear = m * np.log(m / np.maximum(zeros, 1))
+        return np.where((raw <= 2.5 * m) & (zeros > 0), linear, raw)
+
+    def to_frame(self, name):
+        return self.keys.assign(**{name: np.rint(self.estimate()).astype(np.int64)})
@@ -0,0 +1,140 @@
+import numpy as np
+import pandas as pd
+
+# Entity type of every id column the apps read. Columns of one entity type
+# share a dictionary so their codes compare directly: user_id holds users and
+# (for accept_chat) astrologers, so all account ids form one entity type. _id
+# names a different entity in each export (profile, chat, astrologer) and is
+# left as is.
+ID_COLUMNS = {
+    'user_id': 'account',
+    'clientId': 'account',
+    'astrologerId': 'account',
+    'userId': 'account',
+    'chatSessionId': 'session',
+}
+
+
+# Append-only string -> code dictionary for one entity type. Codes never change
+# once assigned, so frames encoded earlier stay valid as the dictionary grows.
+class IdDictionary:
+    def __init__(self):
+        self.categories = pd.Index([], dtype=object)
+        self._dtype = None
+
+    def __len__(self):
+        return len(self.categories)
+
+    # Built once per set of categories, so frames encoded in between share it
+    @property
+    def dtype(self):
+        if self._dtype is None:
+            self._dtype = pd.CategoricalDtype(self.categories)
+        return self._dtype
+
+    def extend(self, values):
+        values = pd.unique(np.asarray(values, dtype=object))
+        values = values[pd.notna(values)]
+        new = values[self.categories.get_indexer(values) < 0]
+        if len(new):
+            self.categories = self.categories.append(pd.Index(np.sort(new), dtype=object))
+            self._dtype = None
+        return self
+
+    def encode(self, values):
+        return pd.Series(pd.Categorical(values, dtype=self.dtype), index=values.index)
+
+
+# One IdDictionary per entity type. encode() replaces the id columns of the
+# given frames with categoricals over the shared dictionary (int8/16/32 codes
+# plus one copy of each string); pandas decodes them for display and to_csv.
+class IdRegistry:
+    def __init__(self, columns=ID_COLUMNS):
+        self.columns = columns
+        self.dictionaries = {}
+
+    def dictionary(self, entity):
+        return self.dictionaries.setdefault(entity, IdDictionary())
+
+    def encode(self, *frames):
+        present = [[column for column in frame.columns if column in self.columns] for frame in frames]
+        # Extend every dictionary before encoding so all frames share one dtype
+        for frame, columns in zip(frames, present):
+            for column in columns:
+                values = frame[column]
+                if isinstance(values.dtype, pd.CategoricalDtype):
+                    values = values.cat.categories
+                self.dictionary(self.columns[column]).extend(values)
+        encoded = []
+        for frame, columns in zip(frames, present):
+            frame = frame.copy(deep=False)
+            for column in columns:
+                frame[column] = self.dictionary(self.columns[column]).encode(frame[column])
+            encoded.append(frame)
+        return encoded[0] if len(encoded) == 1 else encoded
+
+
+# Back to plain string columns, e.g. for exports that need object dtype
+def decode_ids(frame, columns=ID_COLUMNS):
+    return frame.astype({column: object for column in frame.columns if column in columns and isinstance(frame[column].dtype, pd.CategoricalDtype)})
+
+
+# Encode frames over dictionaries of their own ids only: frames passed
+# together share codes, and nothing outlives the dataset they belong to
+def encode_ids(*frames):
+    return IdRegistry().encode(*frames)
+
+
+def _categories(part):
+    return part.categories if isinstance(part, SemiJoinIndex) else part.dtype.categories
+
+
+def _same_categories(parts):
+    categories = _categories(parts[0])
+    return all(_categories(part) is categories or _categories(part).equals(categories) for part in parts[1:])
+
+
+# Set of ids built once and probed by several filters (a semi-join). For
+# interned ids it is a boolean table over dictionary codes, so a probe is one
+# array take; plain string ids fall back to a hash index and Series.isin.
+# Missing ids match each other, as with isin.
+class SemiJoinIndex:
+    def __init__(self, values):
+        self.categories = None
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            self.categories = values.dtype.categories
+            # Missing values (code -1) land in the spare last slot
+            self.member = np.zeros(len(self.categories) + 1, dtype=bool)
+            self.member[values.cat.codes.to_numpy()] = True
+            self.values = None
+        else:
+            self.values = pd.Index(values.unique())
+
+    def __len__(self):
+        return int(self.member.sum()) if self.categories is not None else len(self.values)
+
+    def contains(self, series):
+        if self.categories is not None and isinstance(series.dtype, pd.CategoricalDtype) and _same_categories([series, self]):
+            return pd.Series(self.member[series.cat.codes.to_numpy()], index=series.index)
+        if self.values is None:
+            values = self.categories[self.member[:-1]]
+            self.values = values.insert(len(values), np.nan) if self.member[-1] else values
+        return series.isin(self.values)
+
+
+# Factorize id values gathered from several arrays/Series into codes sorted by
+# the id string (as pd.factorize(..., sort=True) would). When every part is a
+# categorical over one dictionary only the integer codes are touched.
+def factorize_ids(parts):
+    if parts and all(isinstance(part.dtype, pd.CategoricalDtype) for part in parts) and _same_categories(parts):
+        categories = parts[0].dtype.categories
+        raw_codes = np.concatenate([np.asarray(part.cat.codes if isinstance(part, pd.Series) else part.codes, dtype=np.int64) for part in parts])
+        present = np.zeros(len(categories) + 1, dtype=bool)
+        present[raw_codes] = True  # -1 (missing) lands in the spare last slot
+        used = np.flatnonzero(present[:-1])
+        uniques = categories.take(used).to_numpy(object)
+        order = np.argsort(uniques, kind='stable')
+        remap = np.full(len(categories) + 1, -1, dtype=np.int64)
+        remap[used[order]] = np.arange(len(used))
+        return remap[raw_codes], uniques[order]
+    return pd.factorize(np.concatenate([np.asarray(part, dtype=object) for part in parts]), sort=True)
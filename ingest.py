@@ -0,0 +1,53 @@
+import importlib.util
+
+import pandas as pd
+
+CHAT_COLUMNS = ['userId', 'createdAt', 'hasFreeMins', 'endReason']
+PROFILE_COLUMNS = ['_id', 'createdAt']
+CHAT_DTYPES = {'userId': object, 'endReason': 'category'}
+PROFILE_DTYPES = {'_id': object}
+
+# Mongo exports write ISO 8601 timestamps; pass an explicit strftime format to
+# the readers below if an export uses something else
+DATE_FORMAT = 'ISO8601'
+
+HAS_PYARROW = importlib.util.find_spec('pyarrow') is not None
+
+
+def _read_csv(file, usecols, dtype):
+    if HAS_PYARROW:
+        try:
+            return pd.read_csv(file, usecols=usecols, dtype=dtype, engine='pyarrow')
+        except (ValueError, TypeError):
+            # pyarrow rejects a few inputs the C parser accepts; retry from the start
+            if hasattr(file, 'seek'):
+                file.seek(0)
+    return pd.read_csv(file, usecols=usecols, dtype=dtype)
+
+
+def _parse_created_at(values, date_format):
+    created_at = pd.to_datetime(values, format=date_format)
+    if created_at.dt.tz is not None:
+        created_at = created_at.dt.tz_localize(None)
+    return created_at
+
+
+# Chat export: only the columns the North Star metric reads, with compact dtypes
+def read_chat_csv(file, date_format=DATE_FORMAT):
+    chat_df = _read_csv(file, CHAT_COLUMNS, CHAT_DTYPES)
+    chat_df['createdAt'] = _parse_created_at(chat_df['createdAt'], date_format)
+    # Missing flags become -1 so they never match hasFreeMins == 0, as before
+    chat_df['hasFreeMins'] = chat_df['hasFreeMins'].fillna(-1).astype('int8')
+    return chat_df
+
+
+# Profile export: _id and createdAt only, with userId aliased to _id
+def read_profile_csv(file, date_format=DATE_FORMAT):
+    profile_df = _read_csv(file, PROFILE_COLUMNS, PROFILE_DTYPES)
+    profile_df['createdAt'] = _parse_created_at(profile_df['createdAt'], date_format)
+    profile_df['userId'] = profile_df['_id']
+    return profile_df
+
+
+def filter_chats(chat_df):
+    return chat_df[(chat_df['hasFreeMins'] == 0) & (chat_df['endReason'] != 'NOT_STARTED')]
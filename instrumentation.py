@@ -0,0 +1,133 @@
+import json
+import os
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from functools import wraps
+
+import pandas as pd
+
+# Append every run's stage records to this JSON-lines file when set
+METRICS_LOG = os.environ.get('NSM_METRICS_LOG')
+
+
+def _rows(value):
+    if isinstance(value, (tuple, list)) and value and hasattr(value[0], '__len__'):
+        value = value[0]
+    shape = getattr(value, 'shape', None)
+    return int(shape[0]) if shape else None
+
+
+# Measures of one stage; set rows_out inside the `with` block when the
+# output is not returned through a decorator
+class Stage:
+    def __init__(self, name, rows_in=None):
+        self.name = name
+        self.rows_in = rows_in
+        self.rows_out = None
+        self.seconds = self.cpu_seconds = self.peak_bytes = None
+        self.depth = 0
+
+    def to_dict(self):
+        return {
+            'stage': self.name,
+            'depth': self.depth,
+            'seconds': round(self.seconds, 4),
+            'cpu_seconds': round(self.cpu_seconds, 4),
+            'rows_in': self.rows_in,
+            'rows_out': self.rows_out,
+            'peak_mib': round(self.peak_bytes / 2**20, 2) if self.peak_bytes is not None else None,
+        }
+
+
+# Records wall time, CPU time, rows in/out and the peak of memory allocated
+# during each stage (tracemalloc, which sees NumPy and pandas buffers). Stages
+# may nest; an outer stage's peak includes its inner stages. tracemalloc adds
+# overhead to allocation-heavy code, so it is off unless asked for.
+class StageRecorder:
+    def __init__(self, trace_memory=False):
+        self.trace_memory = trace_memory
+        self.stages = []
+        self._open = []
+
+    @contextmanager
+    def stage(self, name, rows_in=None):
+        record = Stage(name, rows_in)
+        record.depth = len(self._open)
+        if self.trace_memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                record._started_tracing = True
+            elif self._open:
+                # Fold the running peak into the enclosing stage before resetting it
+                outer = self._open[-1]
+                outer._peak = max(outer._peak, tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+            record._base = tracemalloc.get_traced_memory()[0]
+            record._peak = record._base
+        self._open.append(record)
+        self.stages.append(record)
+        started, cpu_started = time.perf_counter(), time.process_time()
+        try:
+            yield record
+        finally:
+            record.seconds = time.perf_counter() - started
+            record.cpu_seconds = time.process_time() - cpu_started
+            self._open.pop()
+            # tracemalloc is process-wide: another session's recorder may have
+            # stopped it meanwhile, leaving this stage without a peak
+            if self.trace_memory and tracemalloc.is_tracing():
+                record._peak = max(record._peak, tracemalloc.get_traced_memory()[1])
+                record.peak_bytes = max(record._peak - record._base, 0)
+                if self._open:
+                    self._open[-1]._peak = max(self._open[-1]._peak, record._peak)
+                    tracemalloc.reset_peak()
+                elif getattr(record, '_started_tracing', False):
+                    tracemalloc.stop()
+
+    # Wrap a call as a stage, taking rows from its first argument and its result
+    def call(self, name, func, *args, **kwargs):
+        with self.stage(name, _rows(args[0]) if args else None) as record:
+            result = func(*args, **kwargs)
+            record.rows_out = _rows(result)
+        return result
+
+    # Decorator form of call()
+    def instrument(self, name=None):
+        def decorate(func):
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                return self.call(name or func.__name__, func, *args, **kwargs)
+            return wrapper
+        return decorate
+
+    def records(self):
+        return [stage.to_dict() for stage in self.stages if stage.seconds is not None]
+
+    def to_frame(self):
+        return pd.DataFrame(self.records(), columns=['stage', 'depth', 'seconds', 'cpu_seconds', 'rows_in', 'rows_out', 'peak_mib'])
+
+    def to_json(self, **context):
+        return json.dumps({'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'), **context, 'stages': self.records()})
+
+    # Append this run as one JSON line, e.g. for a log shipper
+    def export(self, path=METRICS_LOG, **context):
+        if path:
+            with open(path, 'a') as handle:
+                handle.write(self.to_json(**context) + '\n')
+
+
+# Collapsible sidebar section with the stage table and a JSON download
+def show_stage_timings(recorder, **context):
+    import streamlit as st
+
+    records = recorder.to_frame()
+    with st.sidebar.expander("Stage timings"):
+        if records.empty:
+            st.write("No stages recorded in this run.")
+            return
+        table = records.assign(stage=['  ' * depth + name for depth, name in zip(records['depth'], records['stage'])]).drop(columns='depth')
+        st.dataframe(table, hide_index=True)
+        st.download_button("Download timings as JSON", data=recorder.to_json(**context), file_name="stage_timings.json", mime="application/json")
+    recorder.export(**context)
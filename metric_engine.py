@@ -0,0 +1,107 @@
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+from hll import DEFAULT_PRECISION, SketchTable
+from ids import factorize_ids
+
+# One hourly metric: `select` names a method of the source returning the rows
+# to aggregate (with an hour_key column), `entity` is the per-row key column
+# (None for dataset-wide metrics) and `column` is counted distinct ('nunique')
+# or averaged ('mean').
+MetricSpec = namedtuple('MetricSpec', ['name', 'select', 'entity', 'column', 'agg'], defaults=['nunique'])
+
+
+# Replace hour_key with the date and hour columns the output tables have always used
+def with_date_hour(counts, keys):
+    hour_key = counts.pop('hour_key')
+    counts.insert(len(keys), 'date', pd.to_datetime(hour_key // 24, unit='D').dt.date)
+    counts.insert(len(keys) + 1, 'hour', (hour_key % 24).astype('int32'))
+    return counts
+
+
+# Give a wide table from another execution backend (entity_name if per
+# entity, hour_key, one nullable column per spec; sorted by entity then hour)
+# the dtypes and columns hourly_metrics returns
+def finish_hourly_table(table, specs, entity_name='_id'):
+    per_entity = entity_name in table.columns
+    table['hour_key'] = table['hour_key'].astype(np.int64)
+    if per_entity:
+        # Sorted categories, as the factorized codes below
+        table[entity_name] = pd.Categorical(table[entity_name].astype(object))
+    for spec in specs:
+        column = table[spec.name].astype(np.float64)
+        if spec.agg == 'nunique' and column.notna().all():
+            column = column.astype(np.int64)
+        table[spec.name] = column
+    return with_date_hour(table, [entity_name] if per_entity else [])
+
+
+# Compute every spec over one shared (entity, hour) grouping and return a single
+# wide table, equivalent to outer-merging the per-metric groupby tables on
+# [entity_name, 'date', 'hour']. distinct='hll' estimates the distinct counts
+# with HyperLogLog sketches of the given precision instead of exact sets.
+def hourly_metrics(source, specs, entity_name='_id', distinct='exact', precision=DEFAULT_PRECISION):
+    if len({spec.entity is None for spec in specs}) > 1:
+        raise ValueError("cannot mix per-entity and dataset-wide metrics in one table")
+    per_entity = specs[0].entity is not None
+
+    selections = []
+    for spec in specs:
+        rows = getattr(source, spec.select)()
+        selections.append(rows[rows['hour_key'] >= 0])
+    bounds = np.cumsum([0] + [len(rows) for rows in selections])
+
+    # Single factorize of the entity and single sort of the (entity, hour) key
+    hour_key = np.concatenate([rows['hour_key'].to_numpy(np.int64) for rows in selections])
+    if per_entity:
+        entity_codes, entities = factorize_ids([rows[spec.entity] for spec, rows in zip(specs, selections)])
+    else:
+        entity_codes, entities = np.zeros(len(hour_key), dtype=np.int64), np.array([None])
+    valid = entity_codes >= 0
+    first_hour = hour_key.min() if len(hour_key) else 0
+    n_hours = (hour_key.max() - first_hour + 1) if len(hour_key) else 1
+    group_key = entity_codes.astype(np.int64) * n_hours + (hour_key - first_hour)
+    groups, group_index = np.unique(group_key[valid], return_inverse=True)
+    row_group = np.full(len(group_key), -1, dtype=np.int64)
+    row_group[valid] = group_index
+    n_groups = len(groups)
+
+    table = pd.DataFrame({'hour_key': groups % n_hours + first_hour})
+    if per_entity:
+        # Keep the factorized codes: joins against dimensions take by code
+        table.insert(0, entity_name, pd.Categorical.from_codes(groups // n_hours, pd.Index(entities)))
+
+    for index, (spec, rows) in enumerate(zip(specs, selections)):
+        group = row_group[bounds[index]:bounds[index + 1]]
+        present = np.zeros(n_groups, dtype=bool)
+        present[group[group >= 0]] = True
+
+        if spec.agg == 'nunique' and distinct == 'hll':
+            in_group = group >= 0
+            sketches = SketchTable.from_rows(pd.DataFrame({'group': group[in_group]}), rows[spec.column].to_numpy(object)[in_group], precision)
+            result = np.zeros(n_groups, dtype=np.float64)
+            result[sketches.keys['group'].to_numpy()] = np.rint(sketches.estimate())
+        elif spec.agg == 'nunique':
+            value_codes, values = pd.factorize(rows[spec.column])
+            counted = (group >= 0) & (value_codes >= 0)
+            pairs = np.unique(group[counted] * max(len(values), 1) + value_codes[counted])
+            result = np.bincount(pairs // max(len(values), 1), minlength=n_groups).astype(np.float64)
+        elif spec.agg == 'mean':
+            values = rows[spec.column].to_numpy(np.float64)
+            counted = (group >= 0) & ~np.isnan(values)
+            totals = np.bincount(group[counted], weights=values[counted], minlength=n_groups)
+            counts = np.bincount(group[counted], minlength=n_groups)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                result = totals / counts
+        else:
+            raise ValueError(f"Unknown aggregation: {spec.agg}")
+
+        result[~present] = np.nan
+        column = pd.Series(result)
+        if spec.agg == 'nunique' and present.all():
+            column = column.astype(np.int64)
+        table[spec.name] = column
+
+    return with_date_hour(table, [entity_name] if per_entity else [])
@@ -1,89 +1,84 @@
-import pandas as pd
+import os
 import streamlit as st
-from datetime import datetime, timedelta
 import plotly.express as px
+from datetime import datetime
+from app_cache import cached, show_cache_stats, upload_fingerprint
+from dataset_cache import load_cached_csv
+from ids import encode_ids
+from ingest import filter_chats, read_chat_csv, read_profile_csv
+from instrumentation import StageRecorder, show_stage_timings
+from north_star import iterate_date_range
+from north_star_state import NorthStarState
+from polars_backend import HAS_POLARS
 
 # Streamlit UI
 st.title("North Star Metric Dashboard")
+# Stage timings of this rerun; worker processes' memory is not traced
+recorder = StageRecorder(trace_memory=st.sidebar.checkbox("Trace peak memory per stage (slows processing down)", value=False))
+
+
+# Load, filter and intern both exports; cached by the uploads' hashes
+def load_inputs(chat_file, profile_file):
+    # Typed load of the used columns only; createdAt comes back parsed and tz-naive
+    chat_df = recorder.call('read_chats', load_cached_csv, chat_file, read_chat_csv)
+
+    # Filter chat data based on hasFreeMins and end_reason
+    filtered_chat_df = recorder.call('filter_chats', filter_chats, chat_df)
+    profile_df = recorder.call('read_profiles', load_cached_csv, profile_file, read_profile_csv)
+
+    # Intern user ids once for both frames so their codes share one dictionary
+    return recorder.call('encode_ids', encode_ids, filtered_chat_df, profile_df)
+
 
 # File upload for chat data
 chat_file = st.file_uploader("Upload Chat Data CSV", type=["csv"])
-if chat_file is not None:
-    chat_df = pd.read_csv(chat_file)
-    # Convert createdAt to datetime
-    chat_df['createdAt'] = pd.to_datetime(chat_df['createdAt']).dt.tz_localize(None)
-    
-    # Filter chat data based on hasFreeMins and end_reason
-    filtered_chat_df = chat_df[(chat_df['hasFreeMins'] == 0) & (chat_df['endReason'] != 'NOT_STARTED')]
 
 # File upload for user profile data
 profile_file = st.file_uploader("Upload User Profile Data CSV", type=["csv"])
-if profile_file is not None:
-    profile_df = pd.read_csv(profile_file)
-    profile_df['userId'] = profile_df['_id']
-    # Convert createdAt to datetime
-    profile_df['createdAt'] = pd.to_datetime(profile_df['createdAt']).dt.tz_localize(None)
 
-# Function to count users who are completing their 4th chat on the target date
-def get_users_completing_4th_chat_today(filtered_chat_df, profile_df, target_date):
-    three_months_ago = target_date - timedelta(days=90)
-    
-    recent_profiles_df = profile_df[(profile_df['createdAt'] >= three_months_ago) & (profile_df['createdAt'] <= target_date)]
-    recent_user_ids = recent_profiles_df['userId'].unique()
-    
-    recent_chats_df_up_to_yesterday = filtered_chat_df[(filtered_chat_df['createdAt'] >= three_months_ago) & (filtered_chat_df['createdAt'] < target_date)]
-    
-    chats_on_target_date = filtered_chat_df[filtered_chat_df['createdAt'].dt.date == target_date.date()]
-    
-    user_chat_counts_up_to_yesterday = recent_chats_df_up_to_yesterday.groupby('userId').size()
-    users_less_than_4_chats_yesterday = user_chat_counts_up_to_yesterday[user_chat_counts_up_to_yesterday < 4].index
-    
-    user_chat_counts_today = chats_on_target_date.groupby('userId').size()
-    
-    users_completing_4th_chat_today = [
-        user_id for user_id in users_less_than_4_chats_yesterday
-        if user_chat_counts_up_to_yesterday.get(user_id, 0) + user_chat_counts_today.get(user_id, 0) == 4
-    ]
-    
-    valid_users = [user_id for user_id in users_completing_4th_chat_today if user_id in recent_user_ids]
-    
-    return valid_users
-
-# Function to iterate over date range
-def iterate_date_range(filtered_chat_df, profile_df, start_date_str, end_date_str):
-    start_date = datetime.strptime(start_date_str, '%d-%m-%y')
-    end_date = datetime.strptime(end_date_str, '%d-%m-%y')
-    
-    results = []
-    
-    current_date = start_date
-    while current_date <= end_date:
-        valid_users = get_users_completing_4th_chat_today(filtered_chat_df, profile_df, current_date)
-        results.append({
-            'date': current_date.strftime('%Y-%m-%d'),
-            'unique_user_count': len(valid_users),
-            'user_ids': ','.join(valid_users)  # Join user IDs into a single string
-        })
-        current_date += timedelta(days=1)
-    
-    return pd.DataFrame(results)
+if chat_file is not None and profile_file is not None:
+    input_key = (upload_fingerprint(chat_file), upload_fingerprint(profile_file))
+    with recorder.stage('north_star_inputs') as stage:
+        filtered_chat_df, profile_df = cached('north_star_inputs', input_key, lambda: load_inputs(chat_file, profile_file))
+        stage.rows_out = len(filtered_chat_df)
 
 # Date input fields
 start_date = st.text_input("Enter start date (DD-MM-YY):", "15-08-24")
 end_date = st.text_input("Enter end date (DD-MM-YY):", "22-10-24")
+use_reference = st.checkbox("Use reference day-by-day engine (slow, for checking results)")
+use_polars = st.checkbox("Use the Polars lazy-frame engine", disabled=not HAS_POLARS or use_reference)
+# Only the cumulative engine runs on a process pool
+workers = st.number_input("Worker processes", min_value=1, max_value=os.cpu_count() or 1, value=1, step=1, disabled=use_reference or use_polars)
+incremental = st.checkbox("Incremental update: only compute days after the saved state")
 
 if st.button("Calculate"):
     if chat_file is not None and profile_file is not None:
-        result_df = iterate_date_range(filtered_chat_df, profile_df, start_date, end_date)
+        with recorder.stage('north_star', len(filtered_chat_df)) as stage:
+            if incremental:
+                # Days already in the saved state are kept; only newer days are computed
+                state = NorthStarState.load()
+                state.update(filtered_chat_df, profile_df, datetime.strptime(end_date, '%d-%m-%y'), start_date=datetime.strptime(start_date, '%d-%m-%y'))
+                state.save()
+                result_df = state.history
+            else:
+                # Worker count does not change the result, so it is not part of the key
+                mode = 'reference' if use_reference else 'polars' if use_polars else 'cumulative'
+                result_df = cached('north_star_result', input_key + (start_date, end_date, mode),
+                                   lambda: iterate_date_range(filtered_chat_df, profile_df, start_date, end_date, mode=mode, workers=int(workers) if mode == 'cumulative' else 1))
+            stage.rows_out = len(result_df)
         
         # Display the results
         st.write(result_df)
         
         # Plot the graph
-        fig = px.line(result_df, x='date', y='unique_user_count', title='North Star Metric Over Time', markers=True)
+        fig = recorder.call('chart', px.line, result_df, x='date', y='unique_user_count', title='North Star Metric Over Time', markers=True)
         st.plotly_chart(fig)
         
         # Save results to CSV
         result_df.to_csv('North_Star_Metrix_june_oct_with_userIDs.csv', index=False)
     else:
         st.warning("Please upload both chat and user profile data files.")
+
+# Last, so the panels count this rerun's lookups and stages
+show_cache_stats()
+show_stage_timings(recorder, app=os.path.basename(__file__))
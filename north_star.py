@@ -0,0 +1,208 @@
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from multiprocessing import shared_memory, util
+
+import numpy as np
+import pandas as pd
+
+from ids import factorize_ids
+
+WINDOW_DAYS = 90
+TARGET_CHAT = 4
+DAY_NS = 86_400_000_000_000
+
+
+# Reference path: re-filters the full frames for every target date
+def get_users_completing_4th_chat_today(filtered_chat_df, profile_df, target_date):
+    three_months_ago = target_date - timedelta(days=WINDOW_DAYS)
+
+    recent_profiles_df = profile_df[(profile_df['createdAt'] >= three_months_ago) & (profile_df['createdAt'] <= target_date)]
+    recent_user_ids = recent_profiles_df['userId'].unique()
+
+    recent_chats_df_up_to_yesterday = filtered_chat_df[(filtered_chat_df['createdAt'] >= three_months_ago) & (filtered_chat_df['createdAt'] < target_date)]
+
+    chats_on_target_date = filtered_chat_df[filtered_chat_df['createdAt'].dt.date == target_date.date()]
+
+    user_chat_counts_up_to_yesterday = recent_chats_df_up_to_yesterday.groupby('userId', observed=True).size()
+
+    user_chat_counts_today = chats_on_target_date.groupby('userId', observed=True).size()
+
+    return select_completing_users(user_chat_counts_up_to_yesterday, user_chat_counts_today, recent_user_ids)
+
+
+# Users with 1-3 chats before the target date whose chats today bring them to
+# exactly 4, restricted to recent signups. Aligns on the userId index and uses
+# hash lookups instead of per-user Series.get / array scans.
+def select_completing_users(user_chat_counts_up_to_yesterday, user_chat_counts_today, recent_user_ids):
+    users_less_than_4_chats_yesterday = user_chat_counts_up_to_yesterday[user_chat_counts_up_to_yesterday < TARGET_CHAT]
+    chats_today = user_chat_counts_today.reindex(users_less_than_4_chats_yesterday.index, fill_value=0)
+    completing = users_less_than_4_chats_yesterday.index[(users_less_than_4_chats_yesterday + chats_today).values == TARGET_CHAT]
+    valid_users = completing[completing.isin(pd.Index(recent_user_ids))]
+    return valid_users.tolist()
+
+
+def _to_day_numbers(timestamps):
+    # Whole days since the epoch; target dates are always midnights, so every
+    # window boundary used by the metric falls on a day edge.
+    return timestamps.values.astype('datetime64[ns]').astype(np.int64) // DAY_NS
+
+
+# Map user ids to sorted integer codes shared by chats and profiles, so the
+# engine works on plain NumPy arrays (and code order matches userId order)
+def _encode(filtered_chat_df, profile_df):
+    chats = filtered_chat_df[['userId', 'createdAt']].dropna()
+    profiles = profile_df[['userId', 'createdAt']].dropna()
+    codes, user_ids = factorize_ids([chats['userId'], profiles['userId']])
+    arrays = {
+        'chat_codes': codes[:len(chats)].astype(np.int32),
+        'chat_days': _to_day_numbers(chats['createdAt']).astype(np.int32),
+        'profile_codes': codes[len(chats):].astype(np.int32),
+        'profile_ns': profiles['createdAt'].values.astype('datetime64[ns]').astype(np.int64),
+    }
+    return np.asarray(user_ids, dtype=object), arrays
+
+
+# Single-pass path: one sort of the chats answers every day in [start_day, end_day].
+# Returns (days, user codes) ordered by day, then user.
+def _completing_user_days(chat_codes, chat_days, profile_codes, profile_ns, start_day, end_day):
+    first_day = start_day - WINDOW_DAYS
+    in_scope = (chat_days >= first_day) & (chat_days <= end_day)
+
+    # Composite (user, day) key sorted once; each chat's rolling 90-day ordinal
+    # is its position minus the position of the first chat inside its window.
+    day_span = end_day - first_day + 1
+    keys = np.sort(chat_codes[in_scope].astype(np.int64) * day_span + (chat_days[in_scope] - first_day))
+
+    # One row per (user, day) that has chats inside the requested range
+    unique_keys, first_pos, chats_today = np.unique(keys, return_index=True, return_counts=True)
+    in_range = unique_keys % day_span >= WINDOW_DAYS
+    unique_keys, first_pos, chats_today = unique_keys[in_range], first_pos[in_range], chats_today[in_range]
+
+    window_start = np.searchsorted(keys, unique_keys - WINDOW_DAYS, side='left')
+    chats_before = first_pos - window_start
+
+    completing = (chats_before > 0) & (chats_before < TARGET_CHAT) & (chats_before + chats_today == TARGET_CHAT)
+    candidates = pd.DataFrame({
+        'code': unique_keys[completing] // day_span,
+        'day': unique_keys[completing] % day_span + first_day,
+    })
+
+    # Keep users with a profile created within [target - 90 days, target]
+    profiles = pd.DataFrame({'code': profile_codes.astype(np.int64), 'created_ns': profile_ns})
+    matched = candidates.merge(profiles, on='code', how='inner')
+    target_ns = matched['day'].values * DAY_NS
+    recent = (matched['created_ns'].values >= target_ns - WINDOW_DAYS * DAY_NS) & (matched['created_ns'].values <= target_ns)
+    valid = matched.loc[recent, ['day', 'code']].drop_duplicates().sort_values(['day', 'code'])
+    return valid['day'].values, valid['code'].values
+
+
+def users_completing_4th_chat_by_day(filtered_chat_df, profile_df, start_date, end_date):
+    user_ids, arrays = _encode(filtered_chat_df, profile_df)
+    start_day = _to_day_numbers(pd.DatetimeIndex([start_date]))[0]
+    end_day = _to_day_numbers(pd.DatetimeIndex([end_date]))[0]
+    days, codes = _completing_user_days(start_day=start_day, end_day=end_day, **arrays)
+    return pd.DataFrame({'day': days, 'userId': user_ids[codes]})
+
+
+# Worker side of the parallel path: arrays are attached from shared memory
+# once per process instead of being pickled with every task. The parent
+# creates and unlinks the blocks; workers only attach and close them. Before
+# Python 3.13 attaching registers the block with the resource tracker too, but
+# pool workers share the parent's tracker, so the parent's unlink clears it
+# (unregistering here would make that unlink fail in the tracker).
+_worker_arrays = {}
+
+
+def _attach_shared(specs):
+    for name, (shm_name, shape, dtype) in specs.items():
+        shm = shared_memory.SharedMemory(name=shm_name, **({'track': False} if sys.version_info >= (3, 13) else {}))
+        _worker_arrays[name] = (shm, np.ndarray(shape, dtype=dtype, buffer=shm.buf))
+    # Runs when the worker exits, whether it was forked or spawned
+    util.Finalize(None, _detach_shared, exitpriority=0)
+
+
+def _detach_shared():
+    blocks = [shm for shm, _ in _worker_arrays.values()]
+    # The arrays must go before the buffers they view can be released
+    _worker_arrays.clear()
+    for shm in blocks:
+        shm.close()
+
+
+def _completing_user_days_chunk(start_day, end_day):
+    arrays = {name: array for name, (_, array) in _worker_arrays.items()}
+    return _completing_user_days(start_day=start_day, end_day=end_day, **arrays)
+
+
+def users_completing_4th_chat_by_day_parallel(filtered_chat_df, profile_df, start_date, end_date, workers=None, chunks_per_worker=2):
+    workers = workers or os.cpu_count() or 1
+    user_ids, arrays = _encode(filtered_chat_df, profile_df)
+    start_day = _to_day_numbers(pd.DatetimeIndex([start_date]))[0]
+    end_day = _to_day_numbers(pd.DatetimeIndex([end_date]))[0]
+
+    # Contiguous day chunks, so concatenating results keeps date order
+    n_chunks = max(1, min(workers * chunks_per_worker, end_day - start_day + 1))
+    bounds = np.array_split(np.arange(start_day, end_day + 1), n_chunks)
+    bounds = [(int(chunk[0]), int(chunk[-1])) for chunk in bounds if len(chunk)]
+
+    blocks = {}
+    try:
+        specs = {}
+        for name, array in arrays.items():
+            shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+            np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)[:] = array
+            blocks[name] = shm
+            specs[name] = (shm.name, array.shape, array.dtype.str)
+        with ProcessPoolExecutor(max_workers=workers, initializer=_attach_shared, initargs=(specs,)) as pool:
+            parts = list(pool.map(_completing_user_days_chunk, *zip(*bounds)))
+    finally:
+        for shm in blocks.values():
+            shm.close()
+            shm.unlink()
+
+    days = np.concatenate([part[0] for part in parts]) if parts else np.array([], dtype=np.int64)
+    codes = np.concatenate([part[1] for part in parts]) if parts else np.array([], dtype=np.int64)
+    return pd.DataFrame({'day': days, 'userId': user_ids[codes]})
+
+
+def _results_frame(dates, users_by_date):
+    results = []
+    for current_date in dates:
+        valid_users = users_by_date.get(current_date, [])
+        results.append({
+            'date': current_date.strftime('%Y-%m-%d'),
+            'unique_user_count': len(valid_users),
+            'user_ids': ','.join(valid_users)  # Join user IDs into a single string
+        })
+    return pd.DataFrame(results)
+
+
+# Function to iterate over date range; mode='reference' runs the day-by-day path,
+# mode='polars' the lazy-frame path (needs polars), workers > 1 splits the
+# cumulative path across a process pool (the other modes run in this process)
+def iterate_date_range(filtered_chat_df, profile_df, start_date_str, end_date_str, mode='cumulative', workers=1):
+    if workers > 1 and mode in ('reference', 'polars'):
+        raise ValueError(f"workers > 1 needs mode='cumulative', not {mode!r}")
+    start_date = datetime.strptime(start_date_str, '%d-%m-%y')
+    end_date = datetime.strptime(end_date_str, '%d-%m-%y')
+    dates = list(pd.date_range(start_date, end_date, freq='D').to_pydatetime())
+
+    if mode == 'reference':
+        users_by_date = {current_date: get_users_completing_4th_chat_today(filtered_chat_df, profile_df, current_date) for current_date in dates}
+    elif mode in ('cumulative', 'polars'):
+        if mode == 'polars':
+            from polars_backend import users_completing_4th_chat_by_day_polars
+            valid = users_completing_4th_chat_by_day_polars(filtered_chat_df, profile_df, start_date, end_date)
+        elif workers > 1:
+            valid = users_completing_4th_chat_by_day_parallel(filtered_chat_df, profile_df, start_date, end_date, workers=workers)
+        else:
+            valid = users_completing_4th_chat_by_day(filtered_chat_df, profile_df, start_date, end_date)
+        grouped = valid.groupby('day')['userId'].agg(list)
+        epoch = datetime(1970, 1, 1)
+        users_by_date = {epoch + timedelta(days=int(day)): user_list for day, user_list in grouped.items()}
+    else:
+        raise ValueError(f"Unknown mode: {mode}")
+
+    return _results_frame(dates, users_by_date)
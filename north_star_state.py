@@ -0,0 +1,79 @@
+import os
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+from ids import decode_ids
+from north_star import WINDOW_DAYS, _results_frame, users_completing_4th_chat_by_day
+
+DEFAULT_STATE_PATH = 'north_star_state.pkl'
+
+
+# Persisted inputs of the North Star metric: filtered chat timestamps and profile
+# createdAt values still inside the 90-day window, plus the daily results so far.
+# New days are computed from this state alone and older entries are evicted.
+class NorthStarState:
+    def __init__(self, chats=None, profiles=None, history=None, last_date=None):
+        self.chats = chats if chats is not None else pd.DataFrame({'userId': pd.Series(dtype=object), 'createdAt': pd.Series(dtype='datetime64[ns]')})
+        self.profiles = profiles if profiles is not None else pd.DataFrame({'userId': pd.Series(dtype=object), 'createdAt': pd.Series(dtype='datetime64[ns]')})
+        self.history = history if history is not None else pd.DataFrame(columns=['date', 'unique_user_count', 'user_ids'])
+        self.last_date = last_date
+
+    @classmethod
+    def load(cls, path=DEFAULT_STATE_PATH):
+        if not os.path.exists(path):
+            return cls()
+        data = pd.read_pickle(path)
+        return cls(data['chats'], data['profiles'], data['history'], data['last_date'])
+
+    def save(self, path=DEFAULT_STATE_PATH):
+        pd.to_pickle({'chats': self.chats, 'profiles': self.profiles, 'history': self.history, 'last_date': self.last_date}, path)
+
+    # Compute every day after the last processed one up to end_date, or up to
+    # the day of the newest chat in the upload when that is earlier, so days
+    # the upload does not cover yet are computed by a later update. Only chats
+    # newer than the last processed day and profiles not stored yet are taken
+    # from the upload, so passing a full export again does not double count;
+    # with an empty state, start_date is the first day computed.
+    def update(self, filtered_chat_df, profile_df, end_date, start_date=None):
+        if self.last_date is not None:
+            start_date = self.last_date + timedelta(days=1)
+        elif start_date is None:
+            raise ValueError("start_date is required for an empty state")
+        newest = filtered_chat_df['createdAt'].max()
+        if pd.isna(newest):
+            return self.history.iloc[0:0]
+        end_date = min(end_date, newest.to_pydatetime().replace(hour=0, minute=0, second=0, microsecond=0))
+        if start_date > end_date:
+            return self.history.iloc[0:0]
+
+        # The state outlives this process's id dictionaries, so it keeps plain strings
+        window_start = start_date - timedelta(days=WINDOW_DAYS if self.last_date is None else 0)
+        new_chats = filtered_chat_df[['userId', 'createdAt']].dropna()
+        new_chats = new_chats[(new_chats['createdAt'] >= window_start) & (new_chats['createdAt'] < end_date + timedelta(days=1))]
+        self.chats = pd.concat([self.chats, decode_ids(new_chats)], ignore_index=True)
+        new_profiles = profile_df[['userId', 'createdAt']].dropna()
+        new_profiles = new_profiles[new_profiles['createdAt'] >= start_date - timedelta(days=WINDOW_DAYS)]
+        new_profiles = decode_ids(new_profiles)
+        new_profiles = new_profiles[~new_profiles['userId'].isin(self.profiles['userId'])].drop_duplicates()
+        self.profiles = pd.concat([self.profiles, new_profiles], ignore_index=True)
+
+        valid = users_completing_4th_chat_by_day(self.chats, self.profiles, start_date, end_date)
+        epoch = datetime(1970, 1, 1)
+        users_by_date = {epoch + timedelta(days=int(day)): user_list for day, user_list in valid.groupby('day')['userId'].agg(list).items()}
+        dates = list(pd.date_range(start_date, end_date, freq='D').to_pydatetime())
+        new_rows = _results_frame(dates, users_by_date)
+
+        self.history = pd.concat([self.history, new_rows], ignore_index=True) if len(self.history) else new_rows
+        self.last_date = end_date
+        self.evict()
+        return new_rows
+
+    # Drop chats and profiles that can no longer fall inside the window of any
+    # day after last_date, so the state stays bounded by the 90-day window
+    def evict(self):
+        if self.last_date is None:
+            return
+        cutoff = self.last_date + timedelta(days=1) - timedelta(days=WINDOW_DAYS)
+        self.chats = self.chats[self.chats['createdAt'] >= cutoff].reset_index(drop=True)
+        self.profiles = self.profiles[self.profiles['createdAt'] >= cutoff].reset_index(drop=True)
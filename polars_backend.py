@@ -0,0 +1,218 @@
+from functools import cached_property
+
+import numpy as np
+import pandas as pd
+
+from dataset_cache import path_fingerprint
+from events import EVENT_JSON_KEYS, NUMERIC_JSON_KEYS
+from hll import DEFAULT_PRECISION
+from ids import encode_ids
+from metric_engine import finish_hourly_table
+from north_star import DAY_NS, TARGET_CHAT, WINDOW_DAYS, _to_day_numbers
+from processor import EVENT_ID_COLUMNS, HOUR_NS, METRIC_EVENTS, TIMED_EVENTS, UniqueUsersProcessor
+
+try:
+    import polars as pl
+except ImportError:
+    pl = None
+
+HAS_POLARS = pl is not None
+
+HOUR_US = HOUR_NS // 1000
+
+
+def scan_source(source):
+    if isinstance(source, pd.DataFrame):
+        return pl.from_pandas(source).lazy()
+    if str(source).lower().endswith('.parquet'):
+        return pl.scan_parquet(source)
+    # Every column as text, as pandas reads the ids and JSON
+    return pl.scan_csv(source, infer_schema=False)
+
+
+def _event_time(dtype):
+    if dtype == pl.String:
+        return pl.col('event_time').str.to_datetime(time_zone='UTC', strict=False)
+    if getattr(dtype, 'time_zone', None) is None:
+        return pl.col('event_time').dt.replace_time_zone('UTC')
+    return pl.col('event_time').dt.convert_time_zone('UTC')
+
+
+# The relevant events with the columns prepare_events produces: ids as text,
+# paid as a number, event_time in IST for the timed events and hour_key (-1
+# without a time). The event_name filter and the column selection are pushed
+# into the scan, so other event types and columns are never materialized.
+def scan_events(source):
+    frame = scan_source(source)
+    schema = frame.collect_schema()
+    from_json = [key for key in EVENT_JSON_KEYS if key not in schema] if 'other_data' in schema else []
+    columns = [pl.col('event_name').cast(pl.String)]
+    for column in EVENT_ID_COLUMNS + ['paid']:
+        if column in schema:
+            value = pl.col(column)
+        elif column in from_json:
+            value = pl.col('other_data').str.json_path_match(f'$.{column}')
+        else:
+            value = pl.lit(None)
+        columns.append(value.cast(pl.Float64 if column in NUMERIC_JSON_KEYS else pl.String, strict=False).alias(column))
+    event_time = pl.when(pl.col('event_name').is_in(TIMED_EVENTS)).then(_event_time(schema['event_time']).dt.cast_time_unit('us') + pl.duration(minutes=330))
+    columns.append(event_time.alias('event_time'))
+    hour_key = (pl.col('event_time').dt.epoch('us') // HOUR_US).fill_null(-1).cast(pl.Int32)
+    return (frame.filter(pl.col('event_name').cast(pl.String).is_in(METRIC_EVENTS))
+            .select(columns)
+            .with_columns(hour_key.alias('hour_key'))
+            .with_columns((pl.col('hour_key') % 24).cast(pl.Int8).alias('hour')))
+
+
+# UniqueUsersProcessor's row selections as lazy frames. Semi-joins match
+# missing ids to each other, as pandas isin does.
+def lazy_selections(events, cancellation_match):
+    def named(name):
+        return events.filter(pl.col('event_name') == name)
+
+    intake, cancel, accept = named('chat_intake_submit'), named('confirm_cancel_waiting_list'), named('accept_chat')
+    intake_users = intake.select(pl.col('user_id').alias('clientId')).unique()
+    sessions = named('chat_msg_send').select('chatSessionId').unique()
+    completed = accept.join(sessions, on='chatSessionId', how='semi', nulls_equal=True)
+
+    intake_times = intake.filter(pl.col('hour_key') >= 0).select('user_id', 'astrologerId', pl.col('event_time').alias('event_time_intake'), 'hour_key')
+    cancel_times = cancel.select('user_id', 'astrologerId', pl.col('event_time').alias('event_time_cancel'))
+    if cancellation_match == 'latest':
+        # Both sides are sorted on the as-of key, which Polars cannot verify per group
+        pairs = cancel_times.drop_nulls().sort('event_time_cancel').join_asof(
+            intake_times.drop_nulls(['user_id', 'astrologerId']).sort('event_time_intake'),
+            left_on='event_time_cancel', right_on='event_time_intake', by=['user_id', 'astrologerId'], strategy='backward', check_sortedness=False,
+        ).filter(pl.col('event_time_intake').is_not_null())
+    else:
+        pairs = intake_times.join(cancel_times, on=['user_id', 'astrologerId'], how='inner', nulls_equal=True)
+    time_diff = (pl.col('event_time_cancel') - pl.col('event_time_intake')).dt.total_microseconds() / 1_000_000 / 60
+
+    return {
+        'intake_events': intake,
+        'cancel_events': cancel,
+        'accept_events': accept,
+        'open_page_events': named('open_page'),
+        'free_accepts_from_intake_users': accept.filter(pl.col('paid') == 0).join(intake_users, on='clientId', how='semi', nulls_equal=True),
+        'completed_accepts': completed,
+        'free_completed_accepts': completed.filter(pl.col('paid') == 0),
+        'paid_completed_accepts': completed.filter(pl.col('paid').ne_missing(0)),
+        'cancellation_pairs': pairs.with_columns(time_diff.alias('time_diff')),
+    }
+
+
+# One metric as a lazy (entity, hour_key) aggregate
+def lazy_metric(rows, spec, distinct):
+    rows = rows.filter(pl.col('hour_key') >= 0)
+    keys = ['hour_key']
+    if spec.entity is not None:
+        rows = rows.filter(pl.col(spec.entity).is_not_null()).with_columns(pl.col(spec.entity).cast(pl.String).alias('_id'))
+        keys = ['_id', 'hour_key']
+    column = pl.col(spec.column)
+    if spec.agg == 'mean':
+        value = column.mean()
+    elif spec.agg == 'nunique':
+        value = column.drop_nulls().approx_n_unique() if distinct == 'hll' else column.drop_nulls().n_unique()
+    else:
+        raise ValueError(f"Unknown aggregation: {spec.agg}")
+    return rows.group_by(keys).agg(value.alias(spec.name))
+
+
+# UniqueUsersProcessor whose metrics are Polars lazy queries over a scan of the
+# export: source is an event export path (CSV, or Parquet by extension) or a
+# raw_df as the pandas backend takes it, with or without extract_json applied.
+# Every metric is collected at once with collect_all, so the scan, JSON
+# extraction and IST bucketing they share run once. Tables match the pandas
+# backend's; with distinct='hll' the counts are Polars' approx_n_unique
+# estimates. Nodes the hourly cube reads are materialized into pandas on
+# first use.
+class PolarsProcessor(UniqueUsersProcessor):
+    def __init__(self, source, astro_df, cancellation_match='cartesian', distinct='exact', hll_precision=DEFAULT_PRECISION, fingerprint=None):
+        if pl is None:
+            raise ImportError("the Polars backend needs the polars package (pip install polars)")
+        raw_df = source if isinstance(source, pd.DataFrame) else None
+        super().__init__(raw_df, astro_df, cancellation_match, distinct, hll_precision, fingerprint)
+        self.source = source
+
+    # File sources are identified by path, size and modification time rather
+    # than hashed, so large exports are not read just to key the memo
+    @cached_property
+    def fingerprint(self):
+        if self._fingerprint is None and self.raw_df is None:
+            return path_fingerprint(self.source)
+        return super().fingerprint
+
+    @cached_property
+    def lazy_events(self):
+        return scan_events(self.source)
+
+    # Ids are interned as on the pandas path, so the nodes behave the same
+    @cached_property
+    def events(self):
+        return encode_ids(self.lazy_events.collect().to_pandas())
+
+    # Aggregates of every metric this processor knows, from one collect_all
+    @cached_property
+    def metric_frames(self):
+        # cache() keeps the shared scan from running once per metric
+        selections = lazy_selections(self.lazy_events.cache(), self.cancellation_match)
+        specs = list(self.metrics.values())
+        frames = pl.collect_all([lazy_metric(selections[spec.select], spec, self.distinct) for spec in specs])
+        return {spec.name: frame for spec, frame in zip(specs, frames)}
+
+    # Same wide table as metric_engine.hourly_metrics, joined from the
+    # collected aggregates
+    def _hourly_metrics(self, specs):
+        if len({spec.entity is None for spec in specs}) > 1:
+            raise ValueError("cannot mix per-entity and dataset-wide metrics in one table")
+        keys = ['_id', 'hour_key'] if specs[0].entity is not None else ['hour_key']
+        parts = [self.metric_frames[spec.name] for spec in specs]
+        table = pl.concat([part.select(keys) for part in parts]).unique()
+        for part in parts:
+            table = table.join(part, on=keys, how='left')
+        return finish_hourly_table(table.sort(keys).to_pandas(), specs)
+
+
+# userId and createdAt (as ns since the epoch) of a chat or profile frame
+def _lazy_created(frame):
+    return (pl.from_pandas(frame[['userId', 'createdAt']]).lazy()
+            .drop_nulls()
+            .select(pl.col('userId').cast(pl.String), pl.col('createdAt').dt.epoch('ns').alias('created_ns')))
+
+
+# Lazy-frame version of north_star.users_completing_4th_chat_by_day: same
+# inputs, same (day, userId) frame ordered by day then user. Chats per
+# (user, day) are cumulated per user; an as-of join finds the running count
+# just before each 90-day window.
+def users_completing_4th_chat_by_day_polars(filtered_chat_df, profile_df, start_date, end_date):
+    start_day = int(_to_day_numbers(pd.DatetimeIndex([start_date]))[0])
+    end_day = int(_to_day_numbers(pd.DatetimeIndex([end_date]))[0])
+
+    daily = (_lazy_created(filtered_chat_df)
+             .select('userId', (pl.col('created_ns') // DAY_NS).alias('day'))
+             .filter(pl.col('day').is_between(start_day - WINDOW_DAYS, end_day))
+             .group_by('userId', 'day').agg(pl.len().alias('chats_today'))
+             .sort('userId', 'day')
+             .with_columns(pl.col('chats_today').cum_sum().over('userId').alias('through')))
+    # Chats up to day d are all before the window of day d + WINDOW_DAYS + 1
+    before_window = daily.select('userId', (pl.col('day') + WINDOW_DAYS + 1).alias('day'), pl.col('through').alias('before_window'))
+    chats_before = pl.col('through') - pl.col('chats_today') - pl.col('before_window').fill_null(0)
+    candidates = (daily.sort('day')
+                  .join_asof(before_window.sort('day'), on='day', by='userId', strategy='backward', check_sortedness=False)
+                  .filter(pl.col('day') >= start_day)
+                  .with_columns(chats_before.alias('chats_before'))
+                  .filter(pl.col('chats_before').is_between(1, TARGET_CHAT - 1), pl.col('chats_before') + pl.col('chats_today') == TARGET_CHAT))
+
+    # Keep users with a profile created within [target - 90 days, target]
+    target_ns = pl.col('day') * DAY_NS
+    valid = (candidates.join(_lazy_created(profile_df), on='userId', how='inner')
+             .filter(pl.col('created_ns').is_between(target_ns - WINDOW_DAYS * DAY_NS, target_ns))
+             .select('day', 'userId').unique()
+             .sort('day', 'userId')
+             .collect())
+    return pd.DataFrame({'day': valid['day'].to_numpy().astype(np.int64), 'userId': valid['userId'].to_numpy().astype(object)})
+
+
+# Lazy-frame version of north_star.get_users_completing_4th_chat_today; the
+# users come back in id order
+def get_users_completing_4th_chat_today_polars(filtered_chat_df, profile_df, target_date):
+    return users_completing_4th_chat_by_day_polars(filtered_chat_df, profile_df, target_date, target_date)['userId'].tolist()
@@ -0,0 +1,347 @@
+import os
+from functools import cached_property, wraps
+
+import numpy as np
+import pandas as pd
+
+from dataset_cache import frame_fingerprint
+from hll import DEFAULT_PRECISION, SketchTable
+from ids import SemiJoinIndex
+from metric_engine import MetricSpec, hourly_metrics
+from result_cache import ResultCache
+
+IST_OFFSET = pd.Timedelta(hours=5, minutes=30)
+HOUR_NS = 3_600_000_000_000
+
+
+# Event types whose event_time some metric reads (chat_msg_send only feeds
+# the session filter) and the columns the metrics use
+TIMED_EVENTS = ['chat_intake_submit', 'confirm_cancel_waiting_list', 'accept_chat', 'open_page']
+EVENT_COLUMNS = ['event_name', 'user_id', 'astrologerId', 'clientId', 'paid', 'chatSessionId']
+# What the SQL and lazy-frame backends load from an export
+METRIC_EVENTS = TIMED_EVENTS + ['chat_msg_send']
+EVENT_ID_COLUMNS = ['user_id', 'astrologerId', 'clientId', 'chatSessionId']
+
+# Results memoized across processor instances (e.g. Streamlit reruns) by
+# dataset fingerprint and options; least recently used entries are dropped
+# once their total size exceeds the budget
+MEMO_MAX_BYTES = int(os.environ.get('NSM_MEMO_MAX_BYTES', 512 * 2**20))
+_memo = ResultCache(MEMO_MAX_BYTES)
+
+
+# Parse event_time once for the dataset and add the IST hour bucket: hour_key
+# counts IST hours since the epoch (-1 when there is no time) and hour is the
+# hour of day. Calendar dates are derived from hour_key on the small
+# aggregated tables only.
+def prepare_events(raw_df, timed_events=TIMED_EVENTS):
+    events = raw_df[[column for column in EVENT_COLUMNS if column in raw_df.columns]].copy()
+    timed = raw_df['event_name'].isin(timed_events).to_numpy()
+    event_time = pd.Series(pd.NaT, index=raw_df.index, dtype='datetime64[ns, UTC]')
+    event_time[timed] = pd.to_datetime(raw_df.loc[timed, 'event_time'], utc=True) + IST_OFFSET
+    events['event_time'] = event_time
+    events['hour_key'] = hour_keys(event_time)
+    events['hour'] = (events['hour_key'] % 24).astype('int8')
+    return events
+
+
+def hour_keys(timestamps):
+    hour_key = timestamps.values.astype('datetime64[ns]').view('int64') // HOUR_NS
+    return pd.Series(hour_key, index=timestamps.index).where(timestamps.notna(), -1).astype('int32')
+
+
+# name and type by _id; accepts the _id-indexed dimension or a plain
+# astro_type.csv frame (first row wins for repeated ids)
+def astro_lookup(astro_df):
+    if astro_df.index.name != '_id':
+        astro_df = astro_df.drop_duplicates('_id').set_index('_id')
+    return astro_df[['name', 'type']]
+
+
+# Split rows by event_name once; every metric reads from these partitions
+def partition_events(events):
+    return {name: frame for name, frame in events.groupby('event_name', sort=False)}
+
+
+# Memoize a zero-argument method per processor instance. Metrics form a graph:
+# each MetricSpec names its selection node, selections read the event
+# partitions and semi-join sets, and those read the parsed events. Every node
+# is evaluated at most once, on first access.
+def node(method):
+    @wraps(method)
+    def evaluate(self):
+        if method.__name__ not in self._nodes:
+            self._nodes[method.__name__] = method(self)
+        return self._nodes[method.__name__]
+    return evaluate
+
+
+# Step 3: Process Events to Calculate Unique Users
+class UniqueUsersProcessor:
+    # Event types prepare_events parses event_time for; variants whose
+    # metrics read other events extend it
+    timed_events = TIMED_EVENTS
+
+    # cancellation_match: 'cartesian' pairs every intake with every cancel of
+    # the same user and astrologer; 'latest' pairs each cancel only with the
+    # latest intake at or before it (sorted matching, linear memory)
+    # distinct: 'exact' counts distinct ids with hash sets, 'hll' estimates them
+    # with HyperLogLog sketches (see hll.py for the error at each precision)
+    # fingerprint identifies the dataset for memoized results (e.g.
+    # dataset_cache.file_fingerprint of the upload); by default it is hashed
+    # from the event columns on first use
+    def __init__(self, raw_df,astro_df, cancellation_match='cartesian', distinct='exact', hll_precision=DEFAULT_PRECISION, fingerprint=None):
+        if cancellation_match not in ('cartesian', 'latest'):
+            raise ValueError(f"Unknown cancellation_match: {cancellation_match}")
+        if distinct not in ('exact', 'hll'):
+            raise ValueError(f"Unknown distinct mode: {distinct}")
+        self.raw_df = raw_df
+        self.astro_df = astro_df
+        self.cancellation_match = cancellation_match
+        self.distinct = distinct
+        self.hll_precision = hll_precision
+        self.astro_lookup = astro_lookup(astro_df)
+        self._fingerprint = fingerprint
+        self._nodes = {}
+
+    # Parsed events and their partitions are only built when a result is not memoized
+    @cached_property
+    def events(self):
+        return prepare_events(self.raw_df, self.timed_events)
+
+    @cached_property
+    def partitions(self):
+        return partition_events(self.events)
+
+    @cached_property
+    def fingerprint(self):
+        if self._fingerprint is not None:
+            return self._fingerprint
+        return frame_fingerprint(self.raw_df[[column for column in EVENT_COLUMNS + ['event_time'] if column in self.raw_df.columns]])
+
+    # Return the memoized value for key on this dataset and these options, computing it once
+    def memoized(self, key, compute):
+        return _memo.get_or_compute((type(self).__name__, self.fingerprint, self.cancellation_match, self.distinct, self.hll_precision, key), compute)
+
+    def events_named(self, event_name):
+        return self.partitions.get(event_name, self.events.iloc[0:0])
+
+    # Semi-join sets shared by every metric that filters on them, built on first use
+    @cached_property
+    def intake_users(self):
+        return SemiJoinIndex(self.intake_events()['user_id'])
+
+    @cached_property
+    def chatting_sessions(self):
+        return SemiJoinIndex(self.events_named('chat_msg_send')['chatSessionId'])
+
+    # Row selections the metrics aggregate; each keeps hour_key
+    def intake_events(self):
+        return self.events_named('chat_intake_submit')
+
+    def cancel_events(self):
+        return self.events_named('confirm_cancel_waiting_list')
+
+    def accept_events(self):
+        return self.events_named('accept_chat')
+
+    def open_page_events(self):
+        return self.events_named('open_page')
+
+    def page_open_events(self):
+        return self.events_named('page_open')
+
+    @node
+    def free_accepts_from_intake_users(self):
+        accept_events = self.accept_events()
+        return accept_events[(accept_events['paid'] == 0) & self.intake_users.contains(accept_events['clientId'])]
+
+    @node
+    def completed_accepts(self):
+        accept_events = self.accept_events()
+        return accept_events[self.chatting_sessions.contains(accept_events['chatSessionId'])]
+
+    @node
+    def free_completed_accepts(self):
+        accept_events = self.completed_accepts()
+        return accept_events[accept_events['paid'] == 0]
+
+    @node
+    def paid_completed_accepts(self):
+        accept_events = self.completed_accepts()
+        return accept_events[accept_events['paid'] != 0]
+
+    # Intake/cancel pairs of the same user and astrologer, keyed by the intake's hour
+    @node
+    def cancellation_pairs(self):
+        intake_events = self.intake_events()
+        intake_events = intake_events.loc[intake_events['hour_key'] >= 0, ['user_id', 'astrologerId', 'event_time', 'hour_key']]
+        cancel_events = self.cancel_events()[['user_id', 'astrologerId', 'event_time']]
+        if self.cancellation_match == 'latest':
+            intake_events = intake_events.dropna(subset=['user_id', 'astrologerId']).rename(columns={'event_time': 'event_time_intake'})
+            cancel_events = cancel_events.dropna().rename(columns={'event_time': 'event_time_cancel'})
+            merged_events = pd.merge_asof(
+                cancel_events.sort_values('event_time_cancel'), intake_events.sort_values('event_time_intake'),
+                left_on='event_time_cancel', right_on='event_time_intake', by=['user_id', 'astrologerId'], direction='backward',
+            ).dropna(subset=['event_time_intake'])
+            merged_events['hour_key'] = merged_events['hour_key'].astype('int32')
+        else:
+            merged_events = pd.merge(intake_events, cancel_events, on=['user_id', 'astrologerId'], suffixes=('_intake', '_cancel'))
+        merged_events['time_diff'] = (merged_events['event_time_cancel'] - merged_events['event_time_intake']).dt.total_seconds() / 60.0
+        return merged_events
+
+    # Memoized per dataset; the copy keeps callers from editing the stored table
+    def hourly_table(self, names):
+        table = self.memoized(('hourly_table', tuple(names)), lambda: self._hourly_metrics([self.metrics[name] for name in names]))
+        return table.copy()
+
+    # Execution backend of hourly_table; see duckdb_backend.DuckDBProcessor
+    def _hourly_metrics(self, specs):
+        return hourly_metrics(self, specs, distinct=self.distinct, precision=self.hll_precision)
+
+    # Mergeable HyperLogLog sketches of one distinct-count metric keyed by
+    # (entity, hour_key); roll them up to days or weeks with SketchTable.rollup
+    def metric_sketches(self, name, entity_name='_id'):
+        return self.memoized(('metric_sketches', name, entity_name), lambda: self._metric_sketches(name, entity_name))
+
+    def _metric_sketches(self, name, entity_name):
+        spec = self.metrics[name]
+        rows = getattr(self, spec.select)()
+        rows = rows[rows['hour_key'] >= 0]
+        keys = pd.DataFrame({'hour_key': rows['hour_key'].to_numpy()})
+        if spec.entity is not None:
+            keys.insert(0, entity_name, rows[spec.entity].to_numpy(object))
+        return SketchTable.from_rows(keys, rows[spec.column].to_numpy(object), self.hll_precision)
+
+    # All per-astrologer metrics in one wide table keyed by ['_id', 'date', 'hour']
+    def astrologer_hourly(self):
+        return self.hourly_table([spec.name for spec in ASTROLOGER_METRICS])
+
+    # All dataset-wide metrics in one wide table keyed by ['date', 'hour']
+    def overall_hourly(self):
+        return self.hourly_table([spec.name for spec in OVERALL_METRICS])
+
+    def process_chat_intake_requests(self):
+        return self.hourly_table(['chat_intake_requests'])
+
+    def process_chat_cancels(self):
+        return self.hourly_table(['cancelled_requests'])
+
+    def cancellation_time(self):
+        return self.hourly_table(['avg_time_diff_minutes'])
+
+    def process_chat_accepted_events(self):
+        return self.hourly_table(['chat_accepted'])
+
+    def process_chat_completed_events(self):
+        return self.hourly_table(['chat_completed'])
+
+    def process_paid_chat_completed_events(self):
+        return self.hourly_table(['paid_chats_completed'])
+
+    # Attach name and type by position: look up each distinct _id once in the
+    # _id-indexed dimension, then take by the table's codes (no row-wise merge)
+    def merge_with_astro_data(self, final_data):
+        ids = final_data['_id']
+        if isinstance(ids.dtype, pd.CategoricalDtype):
+            codes, uniques = ids.cat.codes.to_numpy(), ids.cat.categories
+        else:
+            codes, uniques = pd.factorize(ids)
+        positions = self.astro_lookup.index.get_indexer(uniques)
+        # The appended missing row absorbs unknown ids (-1) and missing _ids
+        positions = np.append(positions, -1)[codes]
+        columns = ['_id', 'name', 'type', 'date', 'hour', 'chat_intake_requests', 'chat_accepted', 'chat_completed','cancelled_requests','avg_time_diff_minutes', 'paid_chats_completed']
+        merged_data = final_data[[column for column in columns if column not in ('name', 'type')]].reset_index(drop=True)
+        for position, column in enumerate(['name', 'type'], start=1):
+            values = np.append(self.astro_lookup[column].to_numpy(object), np.nan)
+            merged_data.insert(position, column, values[positions])
+        return merged_data[columns]
+
+    def merge_with_hour_only(self, final_data):
+        columns = ['date', 'hour', 'chat_intake_overall', 'chat_accepted_overall', 'chat_completed_overall','astros_live']
+        return final_data[columns]
+
+    def process_overall_chat_completed_events(self):
+        return self.hourly_table(['chat_completed_overall'])
+
+    def process_overall_chat_accepted_events(self):
+        return self.hourly_table(['chat_accepted_overall'])
+
+    def process_overall_chat_intake_requests(self):
+        return self.hourly_table(['chat_intake_overall'])
+
+    def astros_live(self):
+        return self.hourly_table(['astros_live'])
+
+    def users_live(self):
+        return self.hourly_table(['users_live'])
+
+
+# Column order of the combined tables matches the outer-merge chains they replace
+ASTROLOGER_METRICS = [
+    MetricSpec('chat_intake_requests', 'intake_events', 'astrologerId', 'user_id'),
+    MetricSpec('chat_accepted', 'free_accepts_from_intake_users', 'user_id', 'clientId'),
+    MetricSpec('chat_completed', 'free_completed_accepts', 'user_id', 'clientId'),
+    MetricSpec('paid_chats_completed', 'paid_completed_accepts', 'user_id', 'clientId'),
+    MetricSpec('cancelled_requests', 'cancel_events', 'astrologerId', 'user_id'),
+    MetricSpec('avg_time_diff_minutes', 'cancellation_pairs', 'astrologerId', 'time_diff', 'mean'),
+]
+OVERALL_METRICS = [
+    MetricSpec('chat_intake_overall', 'intake_events', None, 'user_id'),
+    MetricSpec('chat_accepted_overall', 'free_accepts_from_intake_users', None, 'clientId'),
+    MetricSpec('chat_completed_overall', 'completed_accepts', None, 'clientId'),
+    MetricSpec('astros_live', 'accept_events', None, 'user_id'),
+    MetricSpec('users_live', 'open_page_events', None, 'user_id'),
+]
+METRICS = {spec.name: spec for spec in ASTROLOGER_METRICS + OVERALL_METRICS}
+UniqueUsersProcessor.metrics = METRICS
+
+
+# Variant used by script.py: completed and paid chats are counted from the chat
+# completion export by its createdAt hour (UTC, as before) instead of from
+# accept_chat events
+class CompletedExportProcessor(UniqueUsersProcessor):
+    metrics = {
+        **METRICS,
+        'chat_completed': MetricSpec('chat_completed', 'completed_chats', 'astrologerId', 'userId'),
+        'paid_chats_completed': MetricSpec('paid_chats_completed', 'paid_completed_chats', 'astrologerId', 'userId'),
+    }
+
+    def __init__(self, raw_df, completed_df, astro_df, cancellation_match='cartesian', distinct='exact', hll_precision=DEFAULT_PRECISION, fingerprint=None):
+        super().__init__(raw_df, astro_df, cancellation_match, distinct, hll_precision, fingerprint)
+        self.completed_df = completed_df.assign(hour_key=hour_keys(pd.to_datetime(completed_df['createdAt'], utc=True)))
+
+    # A caller-supplied fingerprint must cover both exports
+    @cached_property
+    def fingerprint(self):
+        if self._fingerprint is not None:
+            return self._fingerprint
+        return frame_fingerprint(self.raw_df[[column for column in EVENT_COLUMNS + ['event_time'] if column in self.raw_df.columns]]) + frame_fingerprint(self.completed_df)
+
+    @node
+    def completed_chats(self):
+        return self.completed_df[(self.completed_df['status'] == 'COMPLETED') & (self.completed_df['type'].isin(['FREE', 'PAID']))]
+
+    @node
+    def paid_completed_chats(self):
+        return self.completed_df[(self.completed_df['status'] == 'COMPLETED') & (self.completed_df['type'] == 'PAID')]
+
+
+# test3.py and test.py count users_live from page_open events
+PAGE_OPEN_USERS_LIVE = MetricSpec('users_live', 'page_open_events', None, 'user_id')
+
+
+# Variant used by test3.py
+class PageOpenProcessor(UniqueUsersProcessor):
+    timed_events = TIMED_EVENTS + ['page_open']
+    metrics = {**METRICS, 'users_live': PAGE_OPEN_USERS_LIVE}
+
+
+# Variant used by test.py: the chat completion export also drives
+# chat_completed_overall
+class PageOpenCompletedExportProcessor(CompletedExportProcessor):
+    timed_events = PageOpenProcessor.timed_events
+    metrics = {
+        **CompletedExportProcessor.metrics,
+        'chat_completed_overall': MetricSpec('chat_completed_overall', 'completed_chats', None, 'userId'),
+        'users_live': PAGE_OPEN_USERS_LIVE,
+    }
@@ -1,7 +1,13 @@
+import os
 import streamlit as st
-import pandas as pd
-import json
 import plotly.express as px
+from app_cache import cached, show_cache_stats, upload_fingerprint
+from charts import TOP_SERIES, X_AXES, line_chart
+from dataset_cache import load_cached_csv
+from events import extract_json
+from ids import encode_ids
+from instrumentation import StageRecorder, show_stage_timings
+from processor import CompletedExportProcessor
 
 # Streamlit App Setup
 st.title("Astrology Chat Data Processor")
@@ -10,123 +16,37 @@ st.title("Astrology Chat Data Processor")
 raw_file = st.file_uploader("Upload raw_data.csv", type="csv")
 completed_file = st.file_uploader("Upload chat_completed_data.csv", type="csv")
 astro_file = st.file_uploader("Upload astro_type.csv", type="csv")
+latest_intake_only = st.checkbox("Pair each cancel with its latest preceding intake (instead of every intake)", value=True)
+# Stage timings of this rerun; stages inside process_uploads only appear when
+# the result cache misses
+recorder = StageRecorder(trace_memory=st.sidebar.checkbox("Trace peak memory per stage (slows processing down)", value=False))
 
-if raw_file and completed_file and astro_file:
-    
-    # Step 2: Extract JSON Data from raw_data.csv and Save to a DataFrame
-    def extract_json(raw_df, json_column):
-        json_data = []
-        for item in raw_df[json_column]:
-            try:
-                data = json.loads(item)
-                json_data.append(data)
-            except (json.JSONDecodeError, TypeError):
-                continue
-        json_df = pd.json_normalize(json_data)
-        combined_df = pd.concat([raw_df, json_df], axis=1)
-        return combined_df
-
-    # Step 3: Process Events to Calculate Unique Users
-    class UniqueUsersProcessor:
-        def __init__(self, raw_df, completed_df, astro_df):
-            self.raw_df = raw_df
-            self.completed_df = completed_df
-            self.astro_df = astro_df
-
-        def process_chat_intake_requests(self):
-            intake_events = self.raw_df[(self.raw_df['event_name'] == 'chat_intake_submit')]
-            intake_events['event_time'] = pd.to_datetime(intake_events['event_time'], utc=True) + pd.DateOffset(hours=5, minutes=30)
-            intake_events['date'] = intake_events['event_time'].dt.date
-            intake_events['hour'] = intake_events['event_time'].dt.hour
-            user_counts = intake_events.groupby(['astrologerId', 'date', 'hour'])['user_id'].nunique().reset_index()
-            user_counts.rename(columns={'user_id': 'chat_intake_requests', 'astrologerId': '_id'}, inplace=True)
-            return user_counts
-
-        def process_chat_cancels(self):
-            cancel_events = self.raw_df[(self.raw_df['event_name'] == 'confirm_cancel_waiting_list')]
-            cancel_events['event_time'] = pd.to_datetime(cancel_events['event_time'], utc=True) + pd.DateOffset(hours=5, minutes=30)
-            cancel_events['date'] = cancel_events['event_time'].dt.date
-            cancel_events['hour'] = cancel_events['event_time'].dt.hour
-            user_counts = cancel_events.groupby(['astrologerId', 'date', 'hour'])['user_id'].nunique().reset_index()
-            user_counts.rename(columns={'user_id': 'cancelled_requests', 'astrologerId': '_id'}, inplace=True)
-            return user_counts
-
-        def cancellation_time(self):
-            intake_events = self.raw_df[(self.raw_df['event_name'] == 'chat_intake_submit')].copy()
-            intake_events['event_time'] = pd.to_datetime(intake_events['event_time'], utc=True) + pd.DateOffset(hours=5, minutes=30)
-            intake_events['date'] = intake_events['event_time'].dt.date
-            intake_events['hour'] = intake_events['event_time'].dt.hour
-            cancel_events = self.raw_df[(self.raw_df['event_name'] == 'confirm_cancel_waiting_list')].copy()
-            cancel_events['event_time'] = pd.to_datetime(cancel_events['event_time'], utc=True) + pd.DateOffset(hours=5, minutes=30)
-            cancel_events['date'] = cancel_events['event_time'].dt.date
-            cancel_events['hour'] = cancel_events['event_time'].dt.hour
-            merged_events = pd.merge(intake_events, cancel_events, on=['user_id', 'astrologerId'], suffixes=('_intake', '_cancel'))
-            merged_events['time_diff'] = (merged_events['event_time_cancel'] - merged_events['event_time_intake']).dt.total_seconds() / 60.0
-            avg_time_diff = merged_events.groupby(['astrologerId', 'date_intake', 'hour_intake'])['time_diff'].mean().reset_index()
-            avg_time_diff.rename(columns={'astrologerId': '_id', 'date_intake': 'date', 'hour_intake': 'hour', 'time_diff': 'avg_time_diff_minutes'}, inplace=True)
-            return avg_time_diff
-
-        def process_chat_accepted_events(self):
-            intake_events = self.raw_df[self.raw_df['event_name'] == 'chat_intake_submit']
-            valid_user_ids = intake_events['user_id'].unique()
-            accept_events = self.raw_df[(self.raw_df['event_name'] == 'accept_chat') & (self.raw_df['paid'] == 0) & (self.raw_df['clientId'].isin(valid_user_ids))]
-            accept_events['event_time'] = pd.to_datetime(accept_events['event_time'], utc=True) + pd.DateOffset(hours=5, minutes=30)
-            accept_events['date'] = accept_events['event_time'].dt.date
-            accept_events['hour'] = accept_events['event_time'].dt.hour
-            accept_counts = accept_events.groupby(['user_id', 'date', 'hour'])['clientId'].nunique().reset_index()
-            accept_counts.rename(columns={'clientId': 'chat_accepted', 'user_id': '_id'}, inplace=True)
-            return accept_counts
-
-        def process_chat_completed_events(self):
-            completed_events = self.completed_df[(self.completed_df['status'] == 'COMPLETED') & (self.completed_df['type'].isin(['FREE', 'PAID']))]
-            completed_events['createdAt'] = pd.to_datetime(completed_events['createdAt'], utc=True)
-            completed_events['date'] = completed_events['createdAt'].dt.date
-            completed_events['hour'] = completed_events['createdAt'].dt.hour
-            completed_counts = completed_events.groupby(['astrologerId', 'date', 'hour'])['userId'].nunique().reset_index()
-            completed_counts.rename(columns={'userId': 'chat_completed', 'astrologerId': '_id'}, inplace=True)
-            return completed_counts
-
-        def process_paid_chat_completed_events(self):
-            paid_events = self.completed_df[(self.completed_df['status'] == 'COMPLETED') & (self.completed_df['type'] == 'PAID')]
-            paid_events['createdAt'] = pd.to_datetime(paid_events['createdAt'], utc=True)
-            paid_events['date'] = paid_events['createdAt'].dt.date
-            paid_events['hour'] = paid_events['createdAt'].dt.hour
-            paid_counts = paid_events.groupby(['astrologerId', 'date', 'hour'])['userId'].nunique().reset_index()
-            paid_counts.rename(columns={'userId': 'paid_chats_completed', 'astrologerId': '_id'}, inplace=True)
-            return paid_counts
-
-        def merge_with_astro_data(self, final_data):
-            merged_data = pd.merge(final_data, self.astro_df, on='_id', how='left')
-            columns = ['_id', 'name', 'type', 'date', 'hour', 'chat_intake_requests', 'chat_accepted', 'chat_completed','cancelled_requests','avg_time_diff_minutes', 'paid_chats_completed']
-            return merged_data[columns]
 
+# Load -> extract_json -> process -> merge, cached by the uploads' hashes and
+# the cancellation pairing
+def process_uploads(raw_file, completed_file, astro_file, fingerprint, cancellation_match):
     # Read CSV files
-    raw_df = pd.read_csv(raw_file)
-    completed_df = pd.read_csv(completed_file)
-    astro_df = pd.read_csv(astro_file)
+    raw_df = recorder.call('read_csv', load_cached_csv, raw_file)
+    completed_df = recorder.call('read_completed_csv', load_cached_csv, completed_file)
+    astro_df = recorder.call('read_astro_csv', load_cached_csv, astro_file)
 
     # Step 4: Process Data
-    raw_df = extract_json(raw_df, 'other_data')
-    processor = UniqueUsersProcessor(raw_df, completed_df, astro_df)
-    
-    # Process each event type
-    intake_data = processor.process_chat_intake_requests()
-    accepted_data = processor.process_chat_accepted_events()
-    completed_data = processor.process_chat_completed_events()
-    paid_completed_data = processor.process_paid_chat_completed_events()
-    cancelled = processor.process_chat_cancels()
-    cancel_time = processor.cancellation_time()
+    raw_df = recorder.call('extract_json', extract_json, raw_df, 'other_data')
+    # Intern ids once for both frames so their codes share one dictionary
+    raw_df, completed_df = recorder.call('encode_ids', encode_ids, raw_df, completed_df)
+    processor = CompletedExportProcessor(raw_df, completed_df, astro_df, cancellation_match=cancellation_match, fingerprint=fingerprint)
+
+    # Compute every per-astrologer metric in one pass, then merge with astro data
+    return recorder.call('merge_with_astro_data', processor.merge_with_astro_data, recorder.call('astrologer_hourly', processor.astrologer_hourly))
 
-    # Combine results
-    final_results = intake_data
-    final_results = pd.merge(final_results, accepted_data, on=['_id', 'date', 'hour'], how='outer')
-    final_results = pd.merge(final_results, completed_data, on=['_id', 'date', 'hour'], how='outer')
-    final_results = pd.merge(final_results, paid_completed_data, on=['_id', 'date', 'hour'], how='outer')
-    final_results = pd.merge(final_results, cancelled, on=['_id', 'date', 'hour'], how='outer')
-    final_results = pd.merge(final_results, cancel_time, on=['_id', 'date', 'hour'], how='outer')
 
-    # Merge with astro data and display final data
-    merged_data = processor.merge_with_astro_data(final_results)
+if raw_file and completed_file and astro_file:
+    fingerprint = upload_fingerprint(raw_file) + upload_fingerprint(completed_file)
+    cancellation_match = 'latest' if latest_intake_only else 'cartesian'
+    with recorder.stage('completed_export_tables') as stage:
+        merged_data = cached('completed_export_tables', (fingerprint, upload_fingerprint(astro_file), cancellation_match),
+                             lambda: process_uploads(raw_file, completed_file, astro_file, fingerprint, cancellation_match))
+        stage.rows_out = len(merged_data)
     
     # Display final output
     st.write("### Final Processed Data")
@@ -135,19 +55,21 @@ if raw_file and completed_file and astro_file:
     # Plot the graph
     import plotly.express as px
 
-# Plot the graph for Chat Intake Requests - Hour-wise and Astrologer-wise
-    fig1 = px.line(merged_data, x='hour', y='chat_intake_requests', color='name', line_group='name', title="Chat Intake Requests Hour-wise Astrologer-wise")
-    fig1.update_layout(xaxis_title="Hour", yaxis_title="Chat Intake Requests")
+    # Per-astrologer charts are aggregated server-side: top astrologers by
+    # volume plus "Others", a capped number of points, WebGL for large charts
+    chart_x = st.sidebar.selectbox("Chart x axis", list(X_AXES), format_func=X_AXES.get)
+    top_astrologers = st.sidebar.slider("Astrologers per chart (the rest are grouped as Others)", min_value=1, max_value=50, value=TOP_SERIES)
+
+    # Plot the graph for Chat Intake Requests - Hour-wise and Astrologer-wise
+    fig1 = recorder.call('chart_intake', line_chart, merged_data, 'chat_intake_requests', "Chat Intake Requests Hour-wise Astrologer-wise", x=chart_x, top_n=top_astrologers, yaxis_title="Chat Intake Requests")
     st.plotly_chart(fig1)
     
     # Plot the graph for Chat Accept - Hour-wise and Astrologer-wise
-    fig2 = px.line(merged_data, x='hour', y='chat_accepted', color='name',line_group='name', title="Chat Accept Hour-wise Astrologer-wise")
-    fig2.update_layout(xaxis_title="Hour", yaxis_title="Chat Accepted")
+    fig2 = recorder.call('chart_accepted', line_chart, merged_data, 'chat_accepted', "Chat Accept Hour-wise Astrologer-wise", x=chart_x, top_n=top_astrologers, yaxis_title="Chat Accepted")
     st.plotly_chart(fig2)
     
     # Plot the graph for Chat Completed - Hour-wise and Astrologer-wise
-    fig3 = px.line(merged_data, x='hour', y='chat_completed', color='name',line_group='name', title="Chat Completed Hour-wise Astrologer-wise")
-    fig3.update_layout(xaxis_title="Hour", yaxis_title="Chat Completed")
+    fig3 = recorder.call('chart_completed', line_chart, merged_data, 'chat_completed', "Chat Completed Hour-wise Astrologer-wise", x=chart_x, top_n=top_astrologers, yaxis_title="Chat Completed")
     st.plotly_chart(fig3)
 
     # Group data to count distinct astrologers per hour
@@ -161,3 +83,7 @@ if raw_file and completed_file and astro_file:
     # Option to download final data
     csv = merged_data.to_csv(index=False)
     st.download_button("Download Final Data as CSV", data=csv, file_name="combined_data_final_hour_wise.csv", mime="text/csv")
+
+# Last, so the panels count this rerun's lookups and stages
+show_cache_stats()
+show_stage_timings(recorder, app=os.path.basename(__file__))
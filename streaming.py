@@ -0,0 +1,119 @@
+import pandas as pd
+
+from events import extract_json
+from ids import IdRegistry
+
+IST_OFFSET = pd.Timedelta(hours=5, minutes=30)
+
+# Columns each relevant event type contributes to the processor's metrics.
+# Intake and cancel rows keep their exact times: cancellation_time pairs every
+# cancel with intakes of the same user and astrologer, which may come in any
+# later chunk, so none can be dropped early. The other types only need their
+# IST hour and collapse to distinct tuples per hour (accept_chat tuples include
+# chatSessionId, so they rarely do).
+EXACT_EVENTS = {
+    'chat_intake_submit': ['user_id', 'astrologerId'],
+    'confirm_cancel_waiting_list': ['user_id', 'astrologerId'],
+}
+HOURLY_EVENTS = {
+    'accept_chat': ['user_id', 'clientId', 'paid', 'chatSessionId'],
+    'open_page': ['user_id'],
+}
+UNTIMED_EVENTS = {
+    'chat_msg_send': ['chatSessionId'],
+}
+RELEVANT_EVENTS = set(EXACT_EVENTS) | set(HOURLY_EVENTS) | set(UNTIMED_EVENTS)
+RAW_COLUMNS = ['event_name', 'event_time', 'user_id', 'other_data']
+
+
+# Keeps exact, mergeable partial state for UniqueUsersProcessor while an event
+# export is read chunk by chunk. The state holds about one row per relevant
+# event (every intake and cancel, nearly every accept_chat), minus duplicate
+# open_page and chat_msg_send tuples, so it grows with the export's relevant
+# events rather than being bounded by the chunk size; only the other event
+# types, unused columns and the JSON text are dropped. Ids are interned as they
+# arrive, so each state row holds integer codes instead of its own strings.
+class StreamingEventReducer:
+    def __init__(self):
+        self.parts = {name: [] for name in RELEVANT_EVENTS}
+        self.ids = IdRegistry()
+
+    def add_chunk(self, chunk, json_column='other_data'):
+        chunk = chunk[chunk['event_name'].isin(RELEVANT_EVENTS)]
+        if chunk.empty:
+            return self
+        chunk = self.ids.encode(extract_json(chunk.reset_index(drop=True), json_column))
+        event_time = pd.to_datetime(chunk['event_time'], utc=True)
+
+        for name, columns in EXACT_EVENTS.items():
+            rows = chunk.loc[chunk['event_name'] == name, columns].assign(event_time=event_time)
+            self.parts[name].append(rows)
+
+        # Start of the IST hour, expressed back in UTC, stands in for event_time
+        hour_start = (event_time + IST_OFFSET).dt.floor('h') - IST_OFFSET
+        for name, columns in HOURLY_EVENTS.items():
+            rows = chunk.loc[chunk['event_name'] == name, columns].assign(event_time=hour_start)
+            self.parts[name].append(rows.dropna(subset=['event_time']).drop_duplicates())
+
+        for name, columns in UNTIMED_EVENTS.items():
+            self.parts[name].append(chunk.loc[chunk['event_name'] == name, columns].drop_duplicates())
+
+        self._compact()
+        return self
+
+    # Dictionaries only grow, so codes of earlier parts stay valid under the
+    # current categories and are re-typed rather than encoded again
+    def _current_ids(self, frame):
+        for column in frame.columns:
+            if column in self.ids.columns and isinstance(frame[column].dtype, pd.CategoricalDtype):
+                dtype = self.ids.dictionary(self.ids.columns[column]).dtype
+                if frame[column].dtype is not dtype:
+                    frame[column] = pd.Categorical.from_codes(frame[column].cat.codes.to_numpy(), dtype=dtype)
+        return frame
+
+    # Concatenate parts on their codes: concatenating the categoricals would
+    # hash the whole dictionary for every column on every chunk
+    def _concat(self, parts):
+        parts = [self._current_ids(part) for part in parts]
+        dtypes = {column: dtype for column, dtype in parts[0].dtypes.items() if isinstance(dtype, pd.CategoricalDtype)}
+        merged = pd.concat([part.assign(**{column: part[column].cat.codes for column in dtypes}) for part in parts], ignore_index=True)
+        for column, dtype in dtypes.items():
+            merged[column] = pd.Categorical.from_codes(merged[column].to_numpy(), dtype=dtype)
+        return merged
+
+    def _compact(self):
+        for name, parts in self.parts.items():
+            if len(parts) > 1:
+                merged = self._concat(parts)
+                if name not in EXACT_EVENTS:
+                    merged = merged.drop_duplicates()
+                self.parts[name] = [merged]
+
+    # Partial states from different chunks or workers combine without loss
+    def merge(self, other):
+        for name in RELEVANT_EVENTS:
+            # Codes of the other state refer to its own dictionaries
+            self.parts[name].extend(self.ids.encode(part) for part in other.parts[name])
+        self._compact()
+        return self
+
+    # Compact stand-in for the expanded raw_df: UniqueUsersProcessor run on it
+    # returns the same tables as on the full export
+    def to_raw_df(self):
+        frames = []
+        for name, parts in self.parts.items():
+            if parts:
+                frames.append(self._current_ids(parts[0]).assign(event_name=name))
+        if not frames:
+            return pd.DataFrame(columns=['event_name', 'event_time', 'user_id', 'astrologerId', 'clientId', 'paid', 'chatSessionId'])
+        return pd.concat(frames, ignore_index=True)
+
+
+# Read a raw event export in chunks of chunksize rows; peak memory is one chunk
+# plus the reducer state, which grows with the relevant events (see above)
+def read_events_streaming(file, chunksize=500_000, json_column='other_data'):
+    reducer = StreamingEventReducer()
+    wanted = set(RAW_COLUMNS) | {json_column}
+    for chunk in pd.read_csv(file, chunksize=chunksize, usecols=lambda column: column in wanted):
+        reducer.add_chunk(chunk, json_column)
+    return reducer.to_raw_df()
@@ -1,227 +1,109 @@
+import os
 import streamlit as st
-import pandas as pd
-import json
 import plotly.express as px
+from app_cache import cached, show_cache_stats, upload_fingerprint
+from astro_dimension import astro_dimension_version, load_astro_dimension, refresh_astro_dimension
+from charts import TOP_SERIES, X_AXES, line_chart
+from cube import DEFAULT_CUBE_PATH, HourlyCube
+from dataset_cache import load_cached_csv
+from duckdb_backend import HAS_DUCKDB, DuckDBProcessor
+from events import extract_json
+from hll import relative_error
+from ids import encode_ids
+from instrumentation import StageRecorder, show_stage_timings
+from polars_backend import HAS_POLARS, PolarsProcessor
+from processor import UniqueUsersProcessor
+from streaming import read_events_streaming
 
 # Streamlit App Setup
 st.title("Astrology Chat Data Processor")
 
 
 
-# Step 1: Upload Files
-raw_file = st.file_uploader("Upload raw_data.csv", type="csv")
-astro_file = pd.read_csv("https://github.com/Jay5973/North-Star-Metrix/blob/main/astro_type.csv?raw=true")
-
-if raw_file:
-    
-    # Step 2: Extract JSON Data from raw_data.csv and Save to a DataFrame
-    def extract_json(raw_df, json_column):
-        json_data = []
-        for item in raw_df[json_column]:
-            try:
-                data = json.loads(item)
-                json_data.append(data)
-            except (json.JSONDecodeError, TypeError):
-                continue
-        json_df = pd.json_normalize(json_data)
-        combined_df = pd.concat([raw_df, json_df], axis=1)
-        return combined_df
-
-    # Step 3: Process Events to Calculate Unique Users
-    class UniqueUsersProcessor:
-        def __init__(self, raw_df,astro_df):
-            self.raw_df = raw_df
-            self.astro_df = astro_df
-
-        def process_chat_intake_requests(self):
-            intake_events = self.raw_df[(self.raw_df['event_name'] == 'chat_intake_submit')]
-            intake_events['event_time'] = pd.to_datetime(intake_events['event_time'], utc=True) + pd.DateOffset(hours=5, minutes=30)
-            intake_events['date'] = intake_events['event_time'].dt.date
-            intake_events['hour'] = intake_events['event_time'].dt.hour
-            user_counts = intake_events.groupby(['astrologerId', 'date', 'hour'])['user_id'].nunique().reset_index()
-            user_counts.rename(columns={'user_id': 'chat_intake_requests', 'astrologerId': '_id'}, inplace=True)
-            return user_counts
-
-        def process_chat_cancels(self):
-            cancel_events = self.raw_df[(self.raw_df['event_name'] == 'confirm_cancel_waiting_list')]
-            cancel_events['event_time'] = pd.to_datetime(cancel_events['event_time'], utc=True) + pd.DateOffset(hours=5, minutes=30)
-            cancel_events['date'] = cancel_events['event_time'].dt.date
-            cancel_events['hour'] = cancel_events['event_time'].dt.hour
-            user_counts = cancel_events.groupby(['astrologerId', 'date', 'hour'])['user_id'].nunique().reset_index()
-            user_counts.rename(columns={'user_id': 'cancelled_requests', 'astrologerId': '_id'}, inplace=True)
-            return user_counts
-
-        def cancellation_time(self):
-            intake_events = self.raw_df[(self.raw_df['event_name'] == 'chat_intake_submit')].copy()
-            intake_events['event_time'] = pd.to_datetime(intake_events['event_time'], utc=True) + pd.DateOffset(hours=5, minutes=30)
-            intake_events['date'] = intake_events['event_time'].dt.date
-            intake_events['hour'] = intake_events['event_time'].dt.hour
-            cancel_events = self.raw_df[(self.raw_df['event_name'] == 'confirm_cancel_waiting_list')].copy()
-            cancel_events['event_time'] = pd.to_datetime(cancel_events['event_time'], utc=True) + pd.DateOffset(hours=5, minutes=30)
-            cancel_events['date'] = cancel_events['event_time'].dt.date
-            cancel_events['hour'] = cancel_events['event_time'].dt.hour
-            merged_events = pd.merge(intake_events, cancel_events, on=['user_id', 'astrologerId'], suffixes=('_intake', '_cancel'))
-            merged_events['time_diff'] = (merged_events['event_time_cancel'] - merged_events['event_time_intake']).dt.total_seconds() / 60.0
-            avg_time_diff = merged_events.groupby(['astrologerId', 'date_intake', 'hour_intake'])['time_diff'].mean().reset_index()
-            avg_time_diff.rename(columns={'astrologerId': '_id', 'date_intake': 'date', 'hour_intake': 'hour', 'time_diff': 'avg_time_diff_minutes'}, inplace=True)
-            return avg_time_diff
-
-        def process_chat_accepted_events(self):
-            intake_events = self.raw_df[self.raw_df['event_name'] == 'chat_intake_submit']
-            valid_user_ids = intake_events['user_id'].unique()
-            accept_events = self.raw_df[(self.raw_df['event_name'] == 'accept_chat') & (self.raw_df['paid'] == 0) & (self.raw_df['clientId'].isin(valid_user_ids))]
-            accept_events['event_time'] = pd.to_datetime(accept_events['event_time'], utc=True) + pd.DateOffset(hours=5, minutes=30)
-            accept_events['date'] = accept_events['event_time'].dt.date
-            accept_events['hour'] = accept_events['event_time'].dt.hour
-            accept_counts = accept_events.groupby(['user_id', 'date', 'hour'])['clientId'].nunique().reset_index()
-            accept_counts.rename(columns={'clientId': 'chat_accepted', 'user_id': '_id'}, inplace=True)
-            return accept_counts
-        
-        def process_chat_completed_events(self):
-            intake_events = self.raw_df[self.raw_df['event_name'] == 'chat_msg_send']
-            valid_user_ids = intake_events['chatSessionId'].unique()
-            accept_events = self.raw_df[(self.raw_df['event_name'] == 'accept_chat') & (self.raw_df['paid'] == 0) & (self.raw_df['chatSessionId'].isin(valid_user_ids))]
-            accept_events['event_time'] = pd.to_datetime(accept_events['event_time'], utc=True) + pd.DateOffset(hours=5, minutes=30)
-            accept_events['date'] = accept_events['event_time'].dt.date
-            accept_events['hour'] = accept_events['event_time'].dt.hour
-            accept_counts = accept_events.groupby(['user_id', 'date', 'hour'])['clientId'].nunique().reset_index()
-            accept_counts.rename(columns={'clientId': 'chat_completed', 'user_id': '_id'}, inplace=True)
-            return accept_counts
-        
-        def process_paid_chat_completed_events(self):
-            intake_events = self.raw_df[self.raw_df['event_name'] == 'chat_msg_send']
-            valid_user_ids = intake_events['chatSessionId'].unique()
-            accept_events = self.raw_df[(self.raw_df['event_name'] == 'accept_chat') & (self.raw_df['paid'] != 0) & (self.raw_df['chatSessionId'].isin(valid_user_ids))]
-            accept_events['event_time'] = pd.to_datetime(accept_events['event_time'], utc=True) + pd.DateOffset(hours=5, minutes=30)
-            accept_events['date'] = accept_events['event_time'].dt.date
-            accept_events['hour'] = accept_events['event_time'].dt.hour
-            accept_counts = accept_events.groupby(['user_id', 'date', 'hour'])['clientId'].nunique().reset_index()
-            accept_counts.rename(columns={'clientId': 'paid_chats_completed', 'user_id': '_id'}, inplace=True)
-            return accept_counts
-
-        # def process_chat_completed_events1(self):
-        #     completed_events = self.completed_df[(self.completed_df['status'] == 'COMPLETED') & (self.completed_df['type'].isin(['FREE', 'PAID']))]
-        #     completed_events['createdAt'] = pd.to_datetime(completed_events['createdAt'], utc=True)
-        #     completed_events['date'] = completed_events['createdAt'].dt.date
-        #     completed_events['hour'] = completed_events['createdAt'].dt.hour
-        #     completed_counts = completed_events.groupby(['astrologerId', 'date', 'hour'])['userId'].nunique().reset_index()
-        #     completed_counts.rename(columns={'userId': 'chat_completed', 'astrologerId': '_id'}, inplace=True)
-        #     return completed_counts
+ROLLUPS = {
+    'Overall per hour': ['hour'],
+    'Per astrologer type per hour': ['type', 'hour'],
+    'Per day': ['date'],
+    'Per astrologer type per day': ['type', 'date'],
+    'Per week': ['week'],
+}
 
-        # def process_paid_chat_completed_events1(self):
-        #     paid_events = self.completed_df[(self.completed_df['status'] == 'COMPLETED') & (self.completed_df['type'] == 'PAID')]
-        #     paid_events['createdAt'] = pd.to_datetime(paid_events['createdAt'], utc=True)
-        #     paid_events['date'] = paid_events['createdAt'].dt.date
-        #     paid_events['hour'] = paid_events['createdAt'].dt.hour
-        #     paid_counts = paid_events.groupby(['astrologerId', 'date', 'hour'])['userId'].nunique().reset_index()
-        #     paid_counts.rename(columns={'userId': 'paid_chats_completed', 'astrologerId': '_id'}, inplace=True)
-        #     return paid_counts
 
-        def merge_with_astro_data(self, final_data):
-            merged_data = pd.merge(final_data, self.astro_df, on='_id', how='left')
-            columns = ['_id', 'name', 'type', 'date', 'hour', 'chat_intake_requests', 'chat_accepted', 'chat_completed','cancelled_requests','avg_time_diff_minutes', 'paid_chats_completed']
-            return merged_data[columns]
+# Roll-ups answered from an hourly cube, without the raw events
+def show_rollups(cube):
+    st.write("### Roll-ups")
+    view = st.selectbox("Roll-up", list(ROLLUPS))
+    by = ROLLUPS[view]
+    rollup = cube.rollup(by)
+    st.dataframe(rollup)
+    fig = px.line(rollup, x=by[-1], y=['chat_intake_requests', 'chat_accepted', 'chat_completed', 'active_astrologers'], color=by[0] if len(by) > 1 else None, title=view)
+    st.plotly_chart(fig)
 
-        def merge_with_hour_only(self, final_data):
-            columns = ['date', 'hour', 'chat_intake_overall', 'chat_accepted_overall', 'chat_completed_overall','astros_live']
-            return merged_data[columns]
-        
-        # def process_overall_chat_completed_events1(self):
-        #     completed_events = self.completed_df[(self.completed_df['status'] == 'COMPLETED') & (self.completed_df['type'].isin(['FREE', 'PAID']))]
-        #     completed_events['createdAt'] = pd.to_datetime(completed_events['createdAt'], utc=True)
-        #     completed_events['date'] = completed_events['createdAt'].dt.date
-        #     completed_events['hour'] = completed_events['createdAt'].dt.hour
-        #     completed_counts = completed_events.groupby(['date', 'hour'])['userId'].nunique().reset_index()
-        #     completed_counts.rename(columns={'userId': 'chat_completed_overall'}, inplace=True)
-        #     return completed_counts
-        
-        def process_overall_chat_completed_events(self):
-            intake_events = self.raw_df[self.raw_df['event_name'] == 'chat_msg_send']
-            valid_user_ids = intake_events['chatSessionId'].unique()
-            accept_events = self.raw_df[(self.raw_df['event_name'] == 'accept_chat') & (self.raw_df['chatSessionId'].isin(valid_user_ids))]
-            accept_events['event_time'] = pd.to_datetime(accept_events['event_time'], utc=True) + pd.DateOffset(hours=5, minutes=30)
-            accept_events['date'] = accept_events['event_time'].dt.date
-            accept_events['hour'] = accept_events['event_time'].dt.hour
-            accept_counts = accept_events.groupby(['date', 'hour'])['clientId'].nunique().reset_index()
-            accept_counts.rename(columns={'clientId': 'chat_completed_overall'}, inplace=True)
-            return accept_counts
-        
-        def process_overall_chat_accepted_events(self):
-            intake_events = self.raw_df[self.raw_df['event_name'] == 'chat_intake_submit']
-            valid_user_ids = intake_events['user_id'].unique()
-            accept_events = self.raw_df[(self.raw_df['event_name'] == 'accept_chat') & (self.raw_df['paid'] == 0) & (self.raw_df['clientId'].isin(valid_user_ids))]
-            accept_events['event_time'] = pd.to_datetime(accept_events['event_time'], utc=True) + pd.DateOffset(hours=5, minutes=30)
-            accept_events['date'] = accept_events['event_time'].dt.date
-            accept_events['hour'] = accept_events['event_time'].dt.hour
-            accept_counts = accept_events.groupby(['date', 'hour'])['clientId'].nunique().reset_index()
-            accept_counts.rename(columns={'clientId': 'chat_accepted_overall'}, inplace=True)
-            return accept_counts
-        
-        def process_overall_chat_intake_requests(self):
-            intake_events = self.raw_df[(self.raw_df['event_name'] == 'chat_intake_submit')]
-            intake_events['event_time'] = pd.to_datetime(intake_events['event_time'], utc=True) + pd.DateOffset(hours=5, minutes=30)
-            intake_events['date'] = intake_events['event_time'].dt.date
-            intake_events['hour'] = intake_events['event_time'].dt.hour
-            user_counts = intake_events.groupby(['date', 'hour'])['user_id'].nunique().reset_index()
-            user_counts.rename(columns={'user_id': 'chat_intake_overall'}, inplace=True)
-            return user_counts
-        
-        def astros_live(self):
-            intake_events = self.raw_df[(self.raw_df['event_name'] == 'accept_chat')]
-            intake_events['event_time'] = pd.to_datetime(intake_events['event_time'], utc=True) + pd.DateOffset(hours=5, minutes=30)
-            intake_events['date'] = intake_events['event_time'].dt.date
-            intake_events['hour'] = intake_events['event_time'].dt.hour
-            user_counts = intake_events.groupby(['date', 'hour'])['user_id'].nunique().reset_index()
-            user_counts.rename(columns={'user_id': 'astros_live'}, inplace=True)
-            return user_counts
-
-        def users_live(self):
-            intake_events = self.raw_df[(self.raw_df['event_name'] == 'open_page')]
-            intake_events['event_time'] = pd.to_datetime(intake_events['event_time'], utc=True) + pd.DateOffset(hours=5, minutes=30)
-            intake_events['date'] = intake_events['event_time'].dt.date
-            intake_events['hour'] = intake_events['event_time'].dt.hour
-            user_counts = intake_events.groupby(['date', 'hour'])['user_id'].nunique().reset_index()
-            user_counts.rename(columns={'user_id': 'users_live'}, inplace=True)
-            return user_counts
-
-    # Read CSV files
-    raw_df = pd.read_csv(raw_file)
-    astro_df = pd.read_csv('https://github.com/Jay5973/North-Star-Metrix/blob/main/astro_type.csv?raw=true')
 
+# Step 1: Upload Files
+raw_file = st.file_uploader("Upload raw_data.csv", type="csv")
+streaming = st.checkbox("Streaming mode (read raw_data.csv in chunks, keeping only the relevant events and columns; memory still grows with those events)")
+chunk_size = st.number_input("Rows per chunk", min_value=10_000, value=500_000, step=100_000, disabled=not streaming)
+latest_intake_only = st.checkbox("Pair each cancel with its latest preceding intake (instead of every intake)", value=True)
+# Alternative backends parse the JSON and aggregate on all cores; exact tables are the same
+BACKENDS = {'duckdb': (HAS_DUCKDB, DuckDBProcessor), 'polars': (HAS_POLARS, PolarsProcessor)}
+backend = st.selectbox("Metric backend", ['pandas'] + [name for name, (available, _) in BACKENDS.items() if available])
+# The error bound is hll.py's; duckdb and polars use their own estimators
+if backend == 'pandas':
+    approximate = st.checkbox(f"Approximate distinct counts (HyperLogLog, about ±{relative_error():.1%} per cell)")
+else:
+    approximate = st.checkbox(f"Approximate distinct counts ({backend}'s built-in estimator; see its documentation for the error)")
+if st.sidebar.button("Refresh astrologer list from GitHub"):
+    try:
+        refresh_astro_dimension()
+    except (OSError, ValueError) as error:
+        # Offline, or the download is not a usable astro_type.csv
+        st.sidebar.warning(f"Could not refresh the astrologer list, using the local copy: {error}")
+astro_df = load_astro_dimension()
+# Stage timings of this rerun; stages inside process_upload only appear when
+# the result cache misses
+recorder = StageRecorder(trace_memory=st.sidebar.checkbox("Trace peak memory per stage (slows processing down)", value=False))
+
+
+# Load -> extract_json -> process -> merge. The result is cached by the
+# upload's hash and the options that change it, so reruns from other widgets
+# skip straight to rendering. Streaming mode gives the same tables, so it is
+# not part of the key; the backend is, as its approximate counts differ.
+def process_upload(raw_file, fingerprint, cancellation_match, distinct, backend):
     # Step 4: Process Data
-    raw_df = extract_json(raw_df, 'other_data')
-    processor = UniqueUsersProcessor(raw_df, astro_df)
-    
-    # Process each event type
-    intake_data = processor.process_chat_intake_requests()
-    accepted_data = processor.process_chat_accepted_events()
-    completed_data = processor.process_chat_completed_events()
-    paid_completed_data = processor.process_paid_chat_completed_events()
-    cancelled = processor.process_chat_cancels()
-    cancel_time = processor.cancellation_time()
-    overall_chat_completed = processor.process_overall_chat_completed_events()
-    overall_chat_intakes = processor.process_overall_chat_intake_requests()
-    overall_chat_accepts = processor.process_overall_chat_accepted_events()
-    astro_live = processor.astros_live()
-    users_live = processor.users_live()
-
-    # Combine results
-    final_results = intake_data
-    final_results = pd.merge(final_results, accepted_data, on=['_id', 'date', 'hour'], how='outer')
-    final_results = pd.merge(final_results, completed_data, on=['_id', 'date', 'hour'], how='outer')
-    final_results = pd.merge(final_results, paid_completed_data, on=['_id', 'date', 'hour'], how='outer')
-    final_results = pd.merge(final_results, cancelled, on=['_id', 'date', 'hour'], how='outer')
-    final_results = pd.merge(final_results, cancel_time, on=['_id', 'date', 'hour'], how='outer')
+    if streaming:
+        raw_df = recorder.call('read_events_streaming', read_events_streaming, raw_file, chunksize=int(chunk_size))
+    else:
+        raw_df = recorder.call('read_csv', load_cached_csv, raw_file)
+    options = dict(cancellation_match=cancellation_match, distinct=distinct, fingerprint=fingerprint)
+    if backend in BACKENDS:
+        # The backend reads other_data itself
+        processor = BACKENDS[backend][1](raw_df, astro_df, **options)
+    else:
+        if not streaming:
+            raw_df = recorder.call('extract_json', extract_json, raw_df, 'other_data')
+        # Ids become dictionary codes; tables and CSV exports still show the strings
+        raw_df = recorder.call('encode_ids', encode_ids, raw_df)
+        processor = UniqueUsersProcessor(raw_df, astro_df, **options)
+
+    # Compute every metric in one pass per table, then merge with astro data
+    merged_data = recorder.call('merge_with_astro_data', processor.merge_with_astro_data, recorder.call('astrologer_hourly', processor.astrologer_hourly))
+    final_overall = recorder.call('overall_hourly', processor.overall_hourly)
+
+    # Materialize the hourly cube so roll-ups skip the raw events
+    with recorder.stage('hourly_cube', len(raw_df)):
+        cube = HourlyCube.build(processor, astro_df)
+    return merged_data, final_overall, cube
 
-    final_overall = overall_chat_intakes
-    final_overall = pd.merge(final_overall, overall_chat_accepts, on=['date', 'hour'], how='outer')
-    final_overall = pd.merge(final_overall, overall_chat_completed, on=['date', 'hour'], how='outer')
-    final_overall = pd.merge(final_overall, astro_live, on=['date', 'hour'], how='outer')
-    final_overall = pd.merge(final_overall, users_live, on=['date', 'hour'], how='outer')
 
-    # Merge with astro data and display final data
-    merged_data = processor.merge_with_astro_data(final_results)
-    merged_overall = final_overall
+if raw_file:
+    fingerprint = upload_fingerprint(raw_file)
+    cancellation_match = 'latest' if latest_intake_only else 'cartesian'
+    distinct = 'hll' if approximate else 'exact'
+    with recorder.stage('hourly_tables') as stage:
+        merged_data, merged_overall, cube = cached('hourly_tables', (fingerprint, cancellation_match, distinct, backend, astro_dimension_version()),
+                                                   lambda: process_upload(raw_file, fingerprint, cancellation_match, distinct, backend))
+        stage.rows_out = len(merged_data)
     
     # Display final output
     st.write("### Final Processed Data")
@@ -229,28 +111,27 @@ if raw_file:
 
     import plotly.express as px
     
+    # Per-astrologer charts are aggregated server-side: top astrologers by
+    # volume plus "Others", a capped number of points, WebGL for large charts
+    chart_x = st.sidebar.selectbox("Chart x axis", list(X_AXES), format_func=X_AXES.get)
+    top_astrologers = st.sidebar.slider("Astrologers per chart (the rest are grouped as Others)", min_value=1, max_value=50, value=TOP_SERIES)
+
     # Plot the graph for Chat Intake Requests - Hour-wise and Astrologer-wise
-    fig1 = px.line(merged_data, x='hour', y='chat_intake_requests', color='name', line_group='name', title="Chat Intake Requests Hour-wise Astrologer-wise")
-    fig1.update_layout(xaxis_title="Hour", yaxis_title="Chat Intake Requests")
-    fig1.update_traces(connectgaps=False)
+    fig1 = recorder.call('chart_intake', line_chart, merged_data, 'chat_intake_requests', "Chat Intake Requests Hour-wise Astrologer-wise", x=chart_x, top_n=top_astrologers, yaxis_title="Chat Intake Requests")
     st.plotly_chart(fig1)
     
     # Plot the graph for Chat Accept - Hour-wise and Astrologer-wise
-    fig2 = px.line(merged_data, x='hour', y='chat_accepted', color='name', line_group='name', title="Chat Accept Hour-wise Astrologer-wise")
-    fig2.update_layout(xaxis_title="Hour", yaxis_title="Chat Accepted")
-    fig2.update_traces(connectgaps=False)
+    fig2 = recorder.call('chart_accepted', line_chart, merged_data, 'chat_accepted', "Chat Accept Hour-wise Astrologer-wise", x=chart_x, top_n=top_astrologers, yaxis_title="Chat Accepted")
     st.plotly_chart(fig2)
     
     # Plot the graph for Chat Completed - Hour-wise and Astrologer-wise
-    fig3 = px.line(merged_data, x='hour', y='chat_completed', color='name', line_group='name', title="Chat Completed Hour-wise Astrologer-wise")
-    fig3.update_layout(xaxis_title="Hour", yaxis_title="Chat Completed")
-    fig3.update_traces(connectgaps=False)
+    fig3 = recorder.call('chart_completed', line_chart, merged_data, 'chat_completed', "Chat Completed Hour-wise Astrologer-wise", x=chart_x, top_n=top_astrologers, yaxis_title="Chat Completed")
     st.plotly_chart(fig3)
     
     print(merged_overall.columns)
     
     # Plot the graph for Overall Metrics
-    fig4 = px.line(merged_overall, x='hour', y=['chat_intake_overall', 'chat_accepted_overall', 'chat_completed_overall', 'astros_live', 'users_live'], 
+    fig4 = recorder.call('chart_overall', px.line, merged_overall, x='hour', y=['chat_intake_overall', 'chat_accepted_overall', 'chat_completed_overall', 'astros_live', 'users_live'], 
                    title="Overall Metrics",
                    labels={
                        'chat_intake_overall': 'Chat Intakes',
@@ -267,3 +148,18 @@ if raw_file:
     # Option to download final data
     csv = merged_data.to_csv(index=False)
     st.download_button("Download Final Data as CSV", data=csv, file_name="combined_data_final_hour_wise.csv", mime="text/csv")
+
+    show_rollups(cube)
+    # The stored cube only changes on request; this upload's hours replace the
+    # stored cells for the same hours rather than adding to them
+    if st.button("Save this upload's hours to the stored cube"):
+        cube.save_merged()
+        st.success("Saved. Roll-ups over every saved upload are shown when no file is uploaded.")
+
+elif os.path.exists(DEFAULT_CUBE_PATH):
+    st.write("Showing roll-ups from the stored cube of saved uploads.")
+    show_rollups(HourlyCube.load())
+
+# Last, so the panels count this rerun's lookups and stages
+show_cache_stats()
+show_stage_timings(recorder, app=os.path.basename(__file__))